@@ -2,17 +2,71 @@
 This module initializes the 'interpreter' package and provides
 a convenient way for users to access the 'Interpreter' class instance.
 
-By assigning an instance of 'Interpreter' to the 'interpreter'
-module, users can easily access the chatbot functionality without
-needing to create an instance themselves.
+By forwarding attribute access on the 'interpreter' module to a shared
+'Interpreter' instance, users can easily access the chatbot functionality
+without needing to create an instance themselves.
 """
 import sys
-from .interpreter import Interpreter
+import types
+
+
+class _InterpreterModule(types.ModuleType):
+    """
+    Module type for the 'interpreter' package.
+
+    Reading or setting an attribute on the module is forwarded to a shared
+    Interpreter instance. The instance (and everything it imports) is only
+    created the first time it is actually used, so `import interpreter`
+    stays cheap.
+    """
+
+    def _get_instance(self):
+        instance = self.__dict__.get("_instance")
+        if instance is None:
+            from .interpreter import Interpreter
+
+            instance = Interpreter()
+            super().__setattr__("_instance", instance)
+        return instance
+
+    def __getattr__(self, name):
+        # Only called for attributes the module doesn't have itself
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        from .interpreter import Interpreter
+
+        if name == "Interpreter":
+            return Interpreter
+
+        # Submodules (like `interpreter.cli`) come first, so
+        # `import interpreter.<submodule> as x` gets the module
+        submodule = sys.modules.get(f"{self.__name__}.{name}")
+        if submodule is not None:
+            return submodule
+
+        # Only forward what an Interpreter has, so looking up anything else
+        # (hasattr(), introspection, typos) doesn't create one
+        instance = self.__dict__.get("_instance")
+        if instance is not None:
+            return getattr(instance, name)
+        if hasattr(Interpreter, name):
+            return getattr(self._get_instance(), name)
+        raise AttributeError(f"module {self.__name__!r} has no attribute {name!r}")
+
+    def __setattr__(self, name, value):
+        if name.startswith("__") or isinstance(value, types.ModuleType):
+            # Dunders, and the submodules the import system binds here,
+            # belong to the module itself
+            super().__setattr__(name, value)
+        else:
+            setattr(self._get_instance(), name, value)
+
 
 # This is done so when users `import interpreter`,
-# they get an instance of interpreter:
+# they get (lazy) access to an instance of interpreter:
 
-sys.modules["interpreter"] = Interpreter()
+sys.modules[__name__].__class__ = _InterpreterModule
 
 # **This is a controversial thing to do,**
 # because perhaps modules ought to behave like modules.
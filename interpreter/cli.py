@@ -7,96 +7,263 @@ configuring the interpreter, and running the chat.
 
 Key Components:
 - check_for_update(): Function to check for updates to Open Interpreter.
+- CLIDefaults: Default CLI flag values read from the environment.
+- prompt_choice(message, choices): Function to pick an item from a numbered list.
+- print_version(): Function to print the installed version of Open Interpreter.
 - cli(interpreter): Function to run the Open Interpreter CLI.
+- main(): Entry point for the `interpreter` console script.
 """
-import argparse
+import functools
+import json
 import os
-from dotenv import load_dotenv
-import requests
-from packaging import version
-import pkg_resources
-from rich import print as rprint
-from rich.markdown import Markdown
-import inquirer
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
 
-# Load .env file
-load_dotenv()
+import appdirs
+
+# The latest version published on PyPI is cached here between runs
+UPDATE_CACHE_PATH = os.path.join(
+    appdirs.user_cache_dir("open-interpreter"), "update.json"
+)
+UPDATE_CHECK_INTERVAL = 24 * 60 * 60  # Seconds
+
+# The first "version" key in PyPI's JSON response is info.version.
+# (Quotes inside string values are escaped, so they can't match.)
+PYPI_VERSION_PATTERN = re.compile(rb'"version":\s*"([^"]+)"')
+
+# .env files to load CLI defaults from, in order of precedence
+DOTENV_PATHS = [".env", os.path.expanduser("~/.open-interpreter/.env")]
+
+
+def _read_update_cache():
+    """
+    Read the cached update check result.
+
+    Returns:
+        dict or None: The cached {"ts", "version", "etag"} entry, or None if
+        there is no usable cache.
+    """
+    try:
+        with open(UPDATE_CACHE_PATH, "r", encoding="utf8") as cache_file:
+            cached = json.load(cache_file)
+        if isinstance(cached.get("ts"), (int, float)) and cached.get("version"):
+            return cached
+    except Exception:
+        pass
+    return None
+
+
+def _write_update_cache(cached):
+    """
+    Atomically write the update check result to the cache file.
+
+    Args:
+        cached (dict): The {"ts", "version", "etag"} entry to store.
+    """
+    os.makedirs(os.path.dirname(UPDATE_CACHE_PATH), exist_ok=True)
+    temp_path = UPDATE_CACHE_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf8") as cache_file:
+        json.dump(cached, cache_file)
+    os.replace(temp_path, UPDATE_CACHE_PATH)
+
+
+def _refresh_update_cache(cached=None):
+    """
+    Fetch the latest version from the PyPI API and store it in the cache.
+    Runs in a background thread, so failures are silently ignored.
+
+    If the previous response's ETag is cached, the request is conditional, and
+    PyPI answers with an empty 304 when nothing has been released since.
+
+    Args:
+        cached (dict, optional): The previous cache entry, if there is one.
+    """
+    import requests
+
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+
+    try:
+        # Short connect timeout, so a bad network can't keep the thread around
+        response = requests.get(
+            "https://pypi.org/pypi/open-interpreter/json",
+            headers=headers,
+            timeout=(2, 5),
+        )
+        if response.status_code == 304:
+            latest_version = cached["version"]
+            etag = cached["etag"]
+        else:
+            response.raise_for_status()
+            # Pick the version out of the raw bytes instead of decoding the
+            # whole metadata document (descriptions, every release, ...)
+            match = PYPI_VERSION_PATTERN.search(response.content)
+            if match:
+                latest_version = match.group(1).decode()
+            else:
+                latest_version = response.json()["info"]["version"]
+            etag = response.headers.get("ETag")
+        _write_update_cache(
+            {"ts": time.time(), "version": latest_version, "etag": etag}
+        )
+    except Exception:
+        # Fine if this fails, we'll try again next time
+        pass
+
+
+@functools.lru_cache(maxsize=1)
+def _current_version():
+    """
+    Look up the installed version of Open Interpreter (once per process).
+    """
+    from importlib.metadata import version
+
+    return version("open-interpreter")
 
 
 def check_for_update():
     """
     Check for updates to Open Interpreter.
 
-    This function fetches the latest version of Open Interpreter from the PyPI API and compares it
-    to the currently installed version.
-    If a newer version is available, it returns True; otherwise, False.
+    This function compares the latest version of Open Interpreter on PyPI to the
+    currently installed version. The latest version is read from an on-disk
+    cache; if the cache is missing or older than a day, it is refreshed in a
+    background thread so the network request never delays the chat.
 
     Returns:
-        bool: True if a newer version is available; otherwise, False.
+        bool: True if a newer version is known to be available; otherwise, False.
 
     """
-    # Fetch the latest version from the PyPI API
-    response = requests.get("https://pypi.org/pypi/open-interpreter/json", timeout=15)
-    latest_version = response.json()["info"]["version"]
+    from packaging import version
 
-    # Get the current version using pkg_resources
-    current_version = pkg_resources.get_distribution("open-interpreter").version
+    cached = _read_update_cache()
 
-    return version.parse(latest_version) > version.parse(current_version)
+    if cached is None or time.time() - cached["ts"] >= UPDATE_CHECK_INTERVAL:
+        threading.Thread(
+            target=_refresh_update_cache, args=(cached,), daemon=True
+        ).start()
 
+    if cached is None:
+        return False
 
-def cli(interpreter):
+    current_version = _current_version()
+
+    return version.parse(cached["version"]) > version.parse(current_version)
+
+
+def _env_bool(name):
     """
-    Run the Open Interpreter command-line interface (CLI).
+    Read a boolean from an environment variable.
 
-    This function takes an instance of the Open Interpreter chatbot, modifies its settings based on
-    command-line arguments, and runs the chat.
+    "1", "true", "yes" and "on" (in any case) count as True, anything else as False.
+    """
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class CLIDefaults:
+    """
+    Default values for the CLI flags, read from INTERPRETER_CLI_* environment variables.
+    """
+
+    auto_run: bool = False
+    fast_mode: bool = False
+    local_run: bool = False
+    debug: bool = False
+    use_azure: bool = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            auto_run=_env_bool("INTERPRETER_CLI_AUTO_RUN"),
+            fast_mode=_env_bool("INTERPRETER_CLI_FAST_MODE"),
+            local_run=_env_bool("INTERPRETER_CLI_LOCAL_RUN"),
+            debug=_env_bool("INTERPRETER_CLI_DEBUG"),
+            use_azure=_env_bool("INTERPRETER_CLI_USE_AZURE"),
+        )
+
+
+def prompt_choice(message, choices):
+    """
+    Ask the user to pick one of a few choices from a numbered list.
 
     Args:
-        interpreter: An instance of the Open Interpreter chatbot.
+        message (str): The question to ask.
+        choices (list): The choices to pick from.
 
     Returns:
-        None
+        str or None: The chosen item (the first one if the user just presses
+        Enter), or None if the prompt was cancelled.
+    """
+    for i, choice in enumerate(choices, start=1):
+        print(f"  {i}) {choice}")
+
+    while True:
+        try:
+            answer = input(f"{message} [1]: ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return None
+
+        if not answer:
+            return choices[0]
+        if answer.isdigit() and 1 <= int(answer) <= len(choices):
+            return choices[int(answer) - 1]
+        if answer in choices:
+            return answer
+        print(f"Please enter a number from 1 to {len(choices)}.")
+
+
+def print_version():
+    """
+    Print the currently installed version of Open Interpreter.
     """
+    print("Open Interpreter", _current_version())
 
-    try:
-        if check_for_update():
-            print(
-                "A new version is available. Please run 'pip install --upgrade open-interpreter'."
-            )
-    except:
-        # Fine if this fails
-        pass
 
-    # Load values from .env file with the new names
-    AUTO_RUN = os.getenv("INTERPRETER_CLI_AUTO_RUN", "False") == "True"
-    FAST_MODE = os.getenv("INTERPRETER_CLI_FAST_MODE", "False") == "True"
-    LOCAL_RUN = os.getenv("INTERPRETER_CLI_LOCAL_RUN", "False") == "True"
-    DEBUG = os.getenv("INTERPRETER_CLI_DEBUG", "False") == "True"
-    USE_AZURE = os.getenv("INTERPRETER_CLI_USE_AZURE", "False") == "True"
+@functools.lru_cache(maxsize=1)
+def _build_parser(defaults):
+    """
+    Build the argument parser for the CLI.
+
+    The parser is cached, so calling cli() again (e.g. in tests) reuses it as
+    long as the defaults haven't changed.
+
+    Args:
+        defaults (CLIDefaults): The default values for the flags.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    # argparse is only imported once we actually need to parse arguments,
+    # so `interpreter --version` stays fast.
+    import argparse
 
-    # Setup CLI
     parser = argparse.ArgumentParser(description="Chat with Open Interpreter.")
 
     parser.add_argument(
         "-y",
         "--yes",
         action="store_true",
-        default=AUTO_RUN,
+        default=defaults.auto_run,
         help="execute code without user confirmation",
     )
     parser.add_argument(
         "-f",
         "--fast",
         action="store_true",
-        default=FAST_MODE,
+        default=defaults.fast_mode,
         help="use gpt-3.5-turbo instead of gpt-4",
     )
     parser.add_argument(
         "-l",
         "--local",
         action="store_true",
-        default=LOCAL_RUN,
+        default=defaults.local_run,
         help="run fully local with code-llama",
     )
     parser.add_argument(
@@ -109,7 +276,7 @@ def cli(interpreter):
         "-d",
         "--debug",
         action="store_true",
-        default=DEBUG,
+        default=defaults.debug,
         help="prints extra information",
     )
 
@@ -141,7 +308,7 @@ def cli(interpreter):
     parser.add_argument(
         "--use-azure",
         action="store_true",
-        default=USE_AZURE,
+        default=defaults.use_azure,
         help="use Azure OpenAI Services",
     )
 
@@ -151,15 +318,64 @@ def cli(interpreter):
         help="display current Open Interpreter version",
     )
 
-    args = parser.parse_args()
+    return parser
+
+
+def cli(interpreter):
+    """
+    Run the Open Interpreter command-line interface (CLI).
+
+    This function takes an instance of the Open Interpreter chatbot, modifies its settings based on
+    command-line arguments, and runs the chat.
+
+    Args:
+        interpreter: An instance of the Open Interpreter chatbot, or None to
+            create one once the command-line arguments have been parsed.
+
+    Returns:
+        None
+    """
+    # `--version` needs none of the setup below, so answer it before building the parser.
+    # (Abbreviations like `--vers` still fall through to argparse.)
+    if "--version" in sys.argv[1:]:
+        print_version()
+        return
+
+    # Load .env files, if there are any. The one in the current directory wins,
+    # since load_dotenv doesn't override variables that are already set.
+    dotenv_paths = [path for path in DOTENV_PATHS if os.path.isfile(path)]
+    if dotenv_paths:
+        from dotenv import load_dotenv
+
+        for path in dotenv_paths:
+            load_dotenv(path)
+
+    # Load flag defaults from the environment (including the .env file)
+    defaults = CLIDefaults.from_env()
+
+    args = _build_parser(defaults).parse_args()
 
     if args.version:
-        print(
-            "Open Interpreter",
-            pkg_resources.get_distribution("open-interpreter").version,
-        )
+        print_version()
         return
 
+    # Only load the interpreter (and its dependencies) when we're actually going to chat
+    # (argparse has already exited for --help)
+    if interpreter is None:
+        from .interpreter import Interpreter
+
+        interpreter = Interpreter()
+
+    # Same goes for checking for updates
+    try:
+        if check_for_update():
+            print(
+                "A new version is available. Please run 'pip install --upgrade open-interpreter'."
+            )
+    except:
+        # Fine if this fails
+        pass
+
     if args.max_tokens:
         interpreter.max_tokens = args.max_tokens
     if args.context_window:
@@ -175,12 +391,14 @@ def cli(interpreter):
         # we've moved this part of llama_2.py here.
         # This way, when folks hit interpreter --local,
         # they get the same experience as before.
+        from rich import print as rprint
+        from rich.markdown import Markdown
 
         rprint(
             "",
             Markdown(
                 "**Open Interpreter** will use `Code Llama` for local execution. "
-                "Use your arrow keys to set up the model."
+                "Pick a model size below."
             ),
             "",
         )
@@ -192,15 +410,10 @@ def cli(interpreter):
         }
 
         parameter_choices = list(models.keys())
-        questions = [
-            inquirer.List(
-                "param",
-                message="Parameter count (smaller is faster, larger is more capable)",
-                choices=parameter_choices,
-            )
-        ]
-        answers = inquirer.prompt(questions)
-        chosen_param = answers["param"] if answers else None
+        chosen_param = prompt_choice(
+            "Parameter count (smaller is faster, larger is more capable)",
+            parameter_choices,
+        )
         if chosen_param is None:
             print("No parameter chosen")
         else:
@@ -232,12 +445,14 @@ def cli(interpreter):
         # we've moved this part of llama_2.py here.
         # This way, when folks hit interpreter --falcon,
         # they get the same experience as --local.
+        from rich import print as rprint
+        from rich.markdown import Markdown
 
         rprint(
             "",
             Markdown(
-                "**Open Interpreter** will use `Falcon` for local execution."
-                "Use your arrow keys to set up the model."
+                "**Open Interpreter** will use `Falcon` for local execution. "
+                "Pick a model size below."
             ),
             "",
         )
@@ -249,15 +464,10 @@ def cli(interpreter):
         }
 
         parameter_choices = list(models.keys())
-        questions = [
-            inquirer.List(
-                "param",
-                message="Parameter count (smaller is faster, larger is more capable)",
-                choices=parameter_choices,
-            )
-        ]
-        answers = inquirer.prompt(questions)
-        chosen_param = answers["param"] if answers else None
+        chosen_param = prompt_choice(
+            "Parameter count (smaller is faster, larger is more capable)",
+            parameter_choices,
+        )
         if chosen_param is None:
             print("No parameter chosen")
         else:
@@ -274,3 +484,13 @@ def cli(interpreter):
 
     # Run the chat method
     interpreter.chat()
+
+
+def main():
+    """
+    Entry point for the `interpreter` console script.
+
+    The Interpreter is only created after the command-line arguments have been
+    parsed, so `interpreter --help` and `interpreter --version` never import it.
+    """
+    cli(None)
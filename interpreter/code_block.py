@@ -8,15 +8,31 @@ to highlight code syntax, handle code execution, and display code outputs.
 Key Components:
 
 - CodeBlock: Main class for displaying and managing code and outputs.
+- HeadlessCodeBlock: A CodeBlock that displays nothing (headless mode).
 """
+import os
+import time
+
 from rich.live import Live
 from rich.panel import Panel
 from rich.box import MINIMAL
 from rich.syntax import Syntax
 from rich.table import Table
+from rich.text import Text
 from rich.console import Group
 from rich.console import Console
 
+# Creating a Console probes the terminal, so every CodeBlock shares this one
+_CONSOLE = Console()
+
+# Styles shared by every refresh
+_SYNTAX_KWARGS = dict(line_numbers=False, word_wrap=True)
+_CODE_THEME = "monokai"
+_ACTIVE_LINE_THEME = "bw"
+_ACTIVE_LINE_STYLE = "black on white"
+_CODE_PANEL_STYLE = "on #272722"
+_OUTPUT_PANEL_STYLE = "#FFFFFF on #3b3b37"
+
 
 class CodeBlock:
     """
@@ -33,6 +49,7 @@ class CodeBlock:
         code (str): The code to be displayed and executed.
         active_line (int): The line number of the currently active code line.
         live: An instance of Rich's Live class for live-updating the code panel.
+        min_refresh_interval (float): Minimum seconds between streamed redraws.
 
     Methods:
         update_from_message(message): Update code and display based on a message.
@@ -47,6 +64,9 @@ class CodeBlock:
         This class is intended for interactive code presentation and execution.
     """
 
+    # Redraw at most ~30 times a second while code is streaming in
+    min_refresh_interval = 1 / 30
+
     def __init__(self):
         """
         Initialize a new CodeBlock instance.
@@ -57,8 +77,21 @@ class CodeBlock:
         self.code = ""
         self.active_line = None
 
+        # Renderables for the lines we last rendered, keyed by
+        # (language, line, is_active), so unchanged lines are reused
+        self._syntax_cache = {}
+        self._last_refresh = 0.0
+
+        # The code split into lines, and the code they were split from
+        self._lines = []
+        self._lines_source = ""
+
+        # Syntax highlighting is wasted work when the output isn't a terminal
+        # (or the user asked for no color), so plain text is shown instead
+        self._highlight = _CONSOLE.is_terminal and os.environ.get("NO_COLOR") is None
+
         self.live = Live(
-            auto_refresh=False, console=Console(), vertical_overflow="visible"
+            auto_refresh=False, console=_CONSOLE, vertical_overflow="visible"
         )
         self.live.start()
 
@@ -84,7 +117,12 @@ class CodeBlock:
                 self.code = parsed_arguments.get("code")
 
                 if self.code and self.language:
-                    self.refresh()
+                    # Skip redraws that come faster than the eye can follow.
+                    # end() always draws the final state.
+                    now = time.monotonic()
+                    if now - self._last_refresh >= self.min_refresh_interval:
+                        self._last_refresh = now
+                        self.refresh()
 
     def end(self):
         """
@@ -114,44 +152,25 @@ class CodeBlock:
         if not code:
             return
 
-        # Create a table for the code
-        code_table = Table(
-            show_header=False, show_footer=False, box=None, padding=0, expand=True
-        )
-        code_table.add_column()
+        if self.active_line is None:
+            # Add cursor
+            if cursor:
+                code += "█"
 
-        # Add cursor
-        if cursor:
-            code += "█"
-
-        # Add each line of code to the table
-        code_lines = code.strip().split("\n")
-        for i, line in enumerate(code_lines, start=1):
-            if i == self.active_line:
-                # This is the active line, print it with a white background
-                syntax = Syntax(
-                    line, self.language, theme="bw", line_numbers=False, word_wrap=True
-                )
-                code_table.add_row(syntax, style="black on white")
-            else:
-                # This is not the active line, print it normally
-                syntax = Syntax(
-                    line,
-                    self.language,
-                    theme="monokai",
-                    line_numbers=False,
-                    word_wrap=True,
-                )
-                code_table.add_row(syntax)
+            # No line to highlight, so the whole block can be one Syntax
+            # (one lexing pass instead of one per line)
+            code_view = self._render_code(code.strip(), theme=_CODE_THEME)
+        else:
+            code_view = self._code_table(cursor)
 
         # Create a panel for the code
-        code_panel = Panel(code_table, box=MINIMAL, style="on #272722")
+        code_panel = Panel(code_view, box=MINIMAL, style=_CODE_PANEL_STYLE)
 
         # Create a panel for the output (if there is any)
         if self.output == "" or self.output == "None":
             output_panel = ""
         else:
-            output_panel = Panel(self.output, box=MINIMAL, style="#FFFFFF on #3b3b37")
+            output_panel = Panel(self.output, box=MINIMAL, style=_OUTPUT_PANEL_STYLE)
 
         # Create a group with the code table and output panel
         group = Group(
@@ -162,3 +181,127 @@ class CodeBlock:
         # Update the live display
         self.live.update(group)
         self.live.refresh()
+
+    def _code_lines(self, cursor):
+        """
+        Yield the lines of the code, as `(code + cursor).strip().split("\n")` would.
+
+        The split lines are kept between refreshes. Streamed code only ever
+        grows, so usually just the new suffix has to be split.
+
+        Args:
+            cursor (bool): Whether to append a cursor to the last line.
+        """
+        code = self.code
+        lines = self._lines
+        source = self._lines_source
+
+        if code != source:
+            if lines and code.startswith(source):
+                new_lines = code[len(source) :].split("\n")
+                lines[-1] += new_lines[0]
+                lines.extend(new_lines[1:])
+            else:
+                lines[:] = code.split("\n")
+            self._lines_source = code
+
+        # Emulate strip(): skip blank lines at the start (and, without a
+        # cursor, at the end), then strip the first and last lines themselves
+        start = 0
+        end = len(lines)
+        while start < end - 1 and not lines[start].strip():
+            start += 1
+        if not cursor:
+            while end - 1 > start and not lines[end - 1].strip():
+                end -= 1
+
+        for i in range(start, end):
+            line = lines[i]
+            if i == start:
+                line = line.lstrip()
+            if i == end - 1:
+                line = line + "█" if cursor else line.rstrip()
+            yield line
+
+    def _code_table(self, cursor):
+        """
+        Build a table with one row per line of code, highlighting the active line.
+
+        Args:
+            cursor (bool): Indicates whether to display a cursor indicating typing.
+
+        Returns:
+            Table: The table of highlighted code lines.
+        """
+        # Create a table for the code
+        code_table = Table(
+            show_header=False, show_footer=False, box=None, padding=0, expand=True
+        )
+        code_table.add_column()
+
+        # Add each line of code to the table, reusing the Syntax objects of
+        # lines that haven't changed since the last refresh
+        previous_cache = self._syntax_cache
+        syntax_cache = {}
+        for i, line in enumerate(self._code_lines(cursor), start=1):
+            is_active = i == self.active_line
+            key = (self.language, line, is_active)
+            syntax = syntax_cache.get(key) or previous_cache.get(key)
+            if syntax is None:
+                if is_active:
+                    # This is the active line, print it with a white background
+                    syntax = self._render_code(line, theme=_ACTIVE_LINE_THEME)
+                else:
+                    # This is not the active line, print it normally
+                    syntax = self._render_code(line, theme=_CODE_THEME)
+            syntax_cache[key] = syntax
+
+            if is_active:
+                code_table.add_row(syntax, style=_ACTIVE_LINE_STYLE)
+            else:
+                code_table.add_row(syntax)
+
+        # Only keep the lines that are on screen now, so the cache stays bounded
+        self._syntax_cache = syntax_cache
+
+        return code_table
+
+    def _render_code(self, code, theme):
+        """
+        Render code with syntax highlighting, or as plain text if highlighting is off.
+
+        Args:
+            code (str): The code to render.
+            theme (str): The Pygments theme to highlight with.
+
+        Returns:
+            Syntax or Text: The renderable for the code.
+        """
+        if not self._highlight:
+            return Text(code)
+        return Syntax(code, self.language, theme=theme, **_SYNTAX_KWARGS)
+
+
+class HeadlessCodeBlock(CodeBlock):
+    """
+    A CodeBlock that keeps track of the code and its output, but never displays them.
+
+    Used when the Interpreter is headless, so no time is spent highlighting
+    and rendering code that nobody is watching.
+    """
+
+    def __init__(self):
+        """
+        Initialize a new HeadlessCodeBlock instance (without a Live display).
+        """
+        self.language = ""
+        self.output = ""
+        self.code = ""
+        self.active_line = None
+        self._last_refresh = 0.0
+
+    def end(self):
+        pass
+
+    def refresh(self, cursor=True):
+        pass
@@ -10,8 +10,6 @@ language-specific configurations, and more.
 """
 from typing import Optional
 import subprocess
-import webbrowser
-import tempfile
 import threading
 import traceback
 import platform
@@ -35,6 +33,9 @@ def run_html(html_content):
         str: A message indicating the file's location and that it has
         been opened with the user's default web browser.
     """
+    import tempfile
+    import webbrowser
+
     # Create a temporary HTML file with the content
     with tempfile.NamedTemporaryFile(delete=False, suffix=".html") as temp_html:
         temp_html.write(html_content.encode())
@@ -115,6 +116,10 @@ class CodeInterpreter:
         self.active_line = None
         self.debug_mode = debug_mode
         self.active_block: Optional[CodeBlock] = None
+        # The subprocess may print something before we run any code
+        self.output = ""
+        # Whether prewarm() started the subprocess, and no code has run in it yet
+        self._prewarmed = False
 
     def start_process(self):
         """
@@ -146,6 +151,30 @@ class CodeInterpreter:
             daemon=True,
         ).start()
 
+    def prewarm(self):
+        """
+        Starts the subprocess ahead of time (e.g. while the user decides
+        whether to run the code), so run() doesn't have to wait for it.
+        """
+        try:
+            open_subprocess = language_map[self.language].get("open_subprocess", True)
+            if open_subprocess and not self.proc:
+                self.start_process()
+                self._prewarmed = True
+        except Exception:
+            # run() will try again, and show the user what went wrong
+            self.proc = None
+
+    def cancel_prewarm(self):
+        """
+        Stops the subprocess prewarm() started, if no code has run in it
+        (e.g. the user declined to run the code it was started for).
+        """
+        if self._prewarmed and self.proc:
+            self.proc.terminate()
+            self.proc = None
+        self._prewarmed = False
+
     def update_active_block(self):
         """
         Updates the active code block with the
@@ -185,6 +214,9 @@ class CodeInterpreter:
         # Should we keep a subprocess open? True by default
         open_subprocess = language_map[self.language].get("open_subprocess", True)
 
+        # The subprocess is in use now, prewarmed or not
+        self._prewarmed = False
+
         # Start the subprocess if it hasn't been started
         if not self.proc and open_subprocess:
             try:
@@ -10,6 +10,7 @@ Key components:
 - cli: Handles command line interface.
 - utils: Helper functions.
 - message_block: Display conversational messages.
+- message_trimmer: Fit the message history in the context window.
 - code_block: Display and run code.
 - code_interpreter: Execute code in different languages.
 
@@ -25,27 +26,61 @@ Usage:
 """
 import os
 import time
+import random
 import traceback
-import json
 import platform
 import getpass
 import builtins
 import readline
+import atexit
+import importlib
+import functools
+import concurrent.futures
+import collections
+import threading
+import hashlib
+
+import appdirs
 
-import inquirer
-import litellm
-import requests
-import tokentrim as tt
 from rich import print
 from rich.markdown import Markdown
 from rich.rule import Rule
-from .code_interpreter import CodeInterpreter
+from .code_interpreter import CodeInterpreter, language_map
+
+from .utils import (
+    coalesce_chunks,
+    dumps_json,
+    loads_json,
+    merge_deltas,
+    CodeFenceParser,
+    PartialJSONParser,
+    StringObjectParser,
+)
+from .message_block import HeadlessMessageBlock, MessageBlock
+from .message_trimmer import MessageTrimmer
+from .code_block import CodeBlock, HeadlessCodeBlock
+
+# litellm (which pulls in openai, tiktoken, ...), inquirer, requests, tokentrim and
+# the HuggingFace loader are slow to import, and many code paths never use them.
+# They're imported where they're used; this keeps `interpreter.interpreter.litellm`
+# and friends working for anyone who reached for them here.
+_LAZY_IMPORTS = {
+    "litellm": "litellm",
+    "inquirer": "inquirer",
+    "requests": "requests",
+    "tt": "tokentrim",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        return importlib.import_module(_LAZY_IMPORTS[name])
+    if name == "get_hf_llm":
+        from .get_hf_llm import get_hf_llm
+
+        return get_hf_llm
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-from .cli import cli
-from .utils import merge_deltas, parse_partial_json
-from .message_block import MessageBlock
-from .code_block import CodeBlock
-from .get_hf_llm import get_hf_llm
 
 # Function schema for gpt-4
 function_schema = {
@@ -65,6 +100,38 @@ function_schema = {
     },
 }
 
+# How long to wait for Open Procedures before responding without them (seconds)
+PROCEDURES_WAIT_TIMEOUT = 2
+
+# Retries for failed LLM calls back off exponentially, with "full jitter": each
+# wait is random, so clients that hit a rate limit together don't retry together
+LLM_ATTEMPTS = 5
+LLM_RETRY_BASE_DELAY = 1  # Seconds
+LLM_RETRY_MAX_DELAY = 8  # Seconds
+
+# Of the client errors (4xx), only these can go away by themselves
+LLM_RETRYABLE_CLIENT_ERRORS = frozenset({408, 409, 429})
+
+# Responses to requests we've sent before are replayed from memory (most recent first)
+RESPONSE_CACHE_SIZE = 32
+
+# Open Procedures results are cached on disk, keyed by a hash of the query
+PROCEDURES_CACHE_PATH = os.path.join(
+    appdirs.user_cache_dir("open-interpreter"), "procedures.sqlite"
+)
+PROCEDURES_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds
+
+# Recent results are also kept in memory, so most turns don't touch the disk
+PROCEDURES_MEMORY_CACHE_SIZE = 128
+PROCEDURES_MEMORY_CACHE_TTL = 5 * 60  # Seconds
+
+# Code-Llama models users can switch to, by parameter count
+LLAMA_MODELS = {
+    "7B": "TheBloke/CodeLlama-7B-Instruct-GGUF",
+    "13B": "TheBloke/CodeLlama-13B-Instruct-GGUF",
+    "34B": "TheBloke/CodeLlama-34B-Instruct-GGUF",
+}
+
 # Message for when users don't have an OpenAI API key.
 MISSING_API_KEY_MESSAGE = """> OpenAI API key not found
 
@@ -89,6 +156,368 @@ Press `CTRL-C` to exit.
 """
 
 
+@functools.lru_cache(maxsize=1)
+def _default_system_message():
+    """
+    Read the default system message from system_message.txt (once per process).
+    """
+    here = os.path.abspath(os.path.dirname(__file__))
+    with open(
+        os.path.join(here, "system_message.txt"), "r", encoding="utf8"
+    ) as default_message:
+        return default_message.read().strip()
+
+
+@functools.lru_cache(maxsize=8)
+def _local_system_message(system_message):
+    """
+    Shorten a system message for Code-Llama (once per system message).
+    """
+    # This is hacky, as we should have a different (minified) prompt for CodeLLama,
+    # but for now, to make the prompt shorter and remove "run_code" references,
+    # just get the first 2 lines:
+    return (
+        "\n".join(system_message.split("\n")[:2])
+        + "\nOnly do what the user asks you to do, "
+        + "then ask what they'd like to do next."
+    )
+
+
+def _get_username():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "unknown"
+
+
+@functools.lru_cache(maxsize=16)
+def _user_info(current_working_directory):
+    """
+    The user info section of the system message, for a working directory.
+    (The username and OS don't change while we run, only the directory does.)
+    """
+    return (
+        f"[User Info]\nName: {_get_username()}\n"
+        f"CWD: {current_working_directory}\n"
+        f"OS: {platform.system() or 'unknown'}"
+    )
+
+
+# Where the prompt's input history is kept between sessions
+HISTORY_PATH = os.path.expanduser("~/.open_interpreter_history")
+HISTORY_LENGTH = 1000
+
+_readline_initialized = False
+
+
+def _init_readline():
+    """
+    Load the input history from the last sessions, and save it when we exit.
+    Only does something the first time it's called.
+    """
+    global _readline_initialized
+    if _readline_initialized:
+        return
+    _readline_initialized = True
+
+    try:
+        readline.read_history_file(HISTORY_PATH)
+    except OSError:
+        # No history yet (or it's unreadable), we'll start a new one
+        pass
+    readline.set_history_length(HISTORY_LENGTH)
+    atexit.register(_save_readline_history)
+
+
+def _save_readline_history():
+    try:
+        readline.write_history_file(HISTORY_PATH)
+    except OSError:
+        pass
+
+
+def _input_without_history(prompt=""):
+    """
+    input(), but the line isn't added to the input history (which is saved to
+    disk), for API keys and other answers that aren't messages.
+    """
+    length = readline.get_current_history_length()
+    try:
+        return input(prompt)
+    finally:
+        if readline.get_current_history_length() > length:
+            readline.remove_history_item(readline.get_current_history_length() - 1)
+
+
+# Commands users can run with `%<command>` (each one is handled by `handle_<command>`)
+COMMAND_NAMES = frozenset(
+    ("help", "debug", "reset", "save_message", "load_message", "undo")
+)
+
+# Descriptions of the commands, for %help
+COMMAND_DESCRIPTIONS = {
+    "%debug [true/false]": "Toggle debug mode. "
+    "Without arguments or with 'true', it enters debug mode. "
+    "With 'false', it exits debug mode.",
+    "%reset": "Resets the current session.",
+    "%undo": "Remove previous messages and its response from the message history.",
+    "%save_message [path]": "Saves messages to a specified JSON (or .jsonl) path. "
+    "If no path is provided, it defaults to 'messages.json'.",
+    "%load_message [path]": "Loads messages from a specified JSON (or .jsonl) path. "
+    "If no path is provided, it defaults to 'messages.json'.",
+    "%help": "Show this help message.",
+}
+
+
+# The %help message
+HELP_MESSAGE = "".join(
+    ["> **Available Commands:**\n\n"]
+    + [f"- `{cmd}`: {desc}\n" for cmd, desc in COMMAND_DESCRIPTIONS.items()]
+    + [
+        "\n\nFor further assistance, please join our community "
+        "Discord or consider contributing to the "
+        "project's development."
+    ]
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _markdown(text):
+    """
+    Parse fixed text (like the %help message) into Markdown once per process.
+    This happens on first use, so importing this module doesn't pay for it.
+    """
+    return Markdown(text)
+
+
+def _message_for_semantic_search(message):
+    """
+    Reduce a message to the parts Open Procedures searches with: its role,
+    content and the parsed arguments of its function call.
+    """
+    message_for_semantic_search = {"role": message.get("role")}
+    content = message.get("content")
+    if content is not None:
+        message_for_semantic_search["content"] = content
+    function_call = message.get("function_call")
+    if function_call and "parsed_arguments" in function_call:
+        message_for_semantic_search["function_call"] = function_call[
+            "parsed_arguments"
+        ]
+    return message_for_semantic_search
+
+
+def _message_for_response_cache(message):
+    """
+    Copy an assistant message (a text answer), so it can be replayed as a single delta.
+    """
+    return dict(message)
+
+
+# Hash of a query -> (time it was stored, procedures), least recently used first.
+# Procedures are fetched on a thread pool, hence the lock.
+_procedures_memory_cache = collections.OrderedDict()
+_procedures_memory_cache_lock = threading.Lock()
+
+
+# One connection to the Open Procedures cache database per process, opened the
+# first time it's needed. It's shared by the thread pool, hence the lock.
+_procedures_cache_connection = None
+_procedures_cache_lock = threading.Lock()
+
+
+def _connect_procedures_cache():
+    """
+    Return the connection to the Open Procedures cache database, opening
+    (and creating) it the first time. Call it with _procedures_cache_lock held.
+    """
+    global _procedures_cache_connection
+    if _procedures_cache_connection is None:
+        import sqlite3
+
+        os.makedirs(os.path.dirname(PROCEDURES_CACHE_PATH), exist_ok=True)
+        connection = sqlite3.connect(
+            PROCEDURES_CACHE_PATH, timeout=1, check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, val TEXT, ts REAL)"
+        )
+        atexit.register(connection.close)
+        _procedures_cache_connection = connection
+    return _procedures_cache_connection
+
+
+def _read_procedures_cache(key):
+    """
+    Look up cached procedures for a query.
+
+    Args:
+        key (str): The hash of the query.
+
+    Returns:
+        list or None: The cached procedures, or None if there's no fresh entry.
+    """
+    with _procedures_memory_cache_lock:
+        entry = _procedures_memory_cache.get(key)
+        if entry is not None:
+            if time.time() - entry[0] < PROCEDURES_MEMORY_CACHE_TTL:
+                _procedures_memory_cache.move_to_end(key)
+                return entry[1]
+            del _procedures_memory_cache[key]
+
+    try:
+        with _procedures_cache_lock:
+            row = _connect_procedures_cache().execute(
+                "SELECT val FROM cache WHERE k = ? AND ts > ?",
+                (key, time.time() - PROCEDURES_CACHE_TTL),
+            ).fetchone()
+        if row is not None:
+            procedures = loads_json(row[0])
+            _remember_procedures(key, procedures)
+            return procedures
+    except Exception:
+        pass
+    return None
+
+
+def _remember_procedures(key, procedures):
+    """
+    Keep procedures in the in-memory cache.
+    """
+    with _procedures_memory_cache_lock:
+        _procedures_memory_cache[key] = (time.time(), procedures)
+        _procedures_memory_cache.move_to_end(key)
+        if len(_procedures_memory_cache) > PROCEDURES_MEMORY_CACHE_SIZE:
+            _procedures_memory_cache.popitem(last=False)
+
+
+def _write_procedures_cache(key, procedures):
+    """
+    Store the procedures returned for a query.
+
+    Args:
+        key (str): The hash of the query.
+        procedures (list): The procedures Open Procedures returned.
+    """
+    _remember_procedures(key, procedures)
+    try:
+        with _procedures_cache_lock:
+            with _connect_procedures_cache() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache (k, val, ts) VALUES (?, ?, ?)",
+                    (key, dumps_json(procedures).decode("utf8"), time.time()),
+                )
+    except Exception:
+        # Fine if this fails, we'll just ask again next time
+        pass
+
+
+def _prompt_segment(message, first, falcon):
+    """
+    Formats one message for Code-Llama's (or Falcon's) prompt template.
+
+    Args:
+        message (dict): The message to format.
+        first (bool): Whether it's the first message (the system message).
+        falcon (bool): Whether to use Falcon's prompt template instead of Llama's.
+
+    Returns:
+        str: The message's part of the prompt.
+    """
+    role = message["role"]
+    content = message["content"]
+
+    # Falcon prompt template
+    if falcon:
+        return f"{role.capitalize()}: {content}\n"
+
+    # Llama prompt template
+    if first:
+        return f"<s>[INST] <<SYS>>\n{content}\n<</SYS>>\n"
+    if role == "user":
+        return f"{content} [/INST] "
+    if role == "function":
+        return f"Output: {content} [/INST] "
+    if role == "assistant":
+        return f"{content} </s><s>[INST] "
+    return ""
+
+
+class _PromptBuilder:
+    """
+    Formats messages as a text prompt for Code-Llama (or Falcon).
+
+    Each turn's messages are mostly the last turn's, plus the new ones.
+    The formatted part of each message is remembered, so only new
+    (or changed) messages are formatted, and when the conversation was only
+    added to, last turn's prompt is extended instead of joined again.
+    """
+
+    def __init__(self):
+        # (message, content, segment) for each message in the last prompt
+        self._segments = []
+        # The last prompt, before the end was trimmed
+        self._prompt = ""
+        self._falcon = False
+
+    def build(self, messages, falcon=False):
+        """
+        Formats messages as a prompt.
+
+        The first message must be the only system message.
+
+        Args:
+            messages (list): The messages to format.
+            falcon (bool): Whether to use Falcon's prompt template instead of Llama's.
+
+        Returns:
+            str: The prompt.
+        """
+        for message in messages:
+            # Happens if it immediatly writes code
+            if "role" not in message:
+                message["role"] = "assistant"
+
+        segments = self._segments if falcon == self._falcon else []
+
+        # Find how many messages are unchanged since last time.
+        # (The system message is a new dict every turn, so compare its content.)
+        kept = 0
+        if segments and messages and messages[0]["content"] == segments[0][1]:
+            kept = 1
+            limit = min(len(segments), len(messages))
+            while kept < limit:
+                message, content, _ = segments[kept]
+                if messages[kept] is not message or message["content"] != content:
+                    break
+                kept += 1
+
+        new_segments = [
+            (message, message["content"], _prompt_segment(message, i == 0, falcon))
+            for i, message in enumerate(messages[kept:], kept)
+        ]
+        new_text = "".join(segment for _, _, segment in new_segments)
+
+        if kept and kept == len(segments):
+            prompt = self._prompt + new_text
+        else:
+            prompt = "".join(segment for _, _, segment in segments[:kept]) + new_text
+
+        self._segments = segments[:kept] + new_segments
+        self._prompt = prompt
+        self._falcon = falcon
+
+        if falcon:
+            return prompt.strip()
+
+        # Remove the trailing '<s>[INST] ' from the final output
+        if prompt.endswith("<s>[INST] "):
+            prompt = prompt[:-10]
+
+        return prompt
+
+
 class Interpreter:
     """
     A class for interpreting and executing scripts.
@@ -112,6 +541,41 @@ class Interpreter:
         interpreter.execute()
     """
 
+    # Every attribute an Interpreter has, which makes the attribute lookups in the
+    # chat loop a little cheaper. (__dict__ is kept, so scripts can still set
+    # attributes of their own on it.)
+    __slots__ = (
+        "__dict__",
+        "messages",
+        "temperature",
+        "api_key",
+        "auto_run",
+        "local",
+        "_model",
+        "_is_falcon",
+        "debug_mode",
+        "api_base",
+        "context_window",
+        "max_tokens",
+        "use_azure",
+        "azure_api_base",
+        "azure_api_version",
+        "azure_deployment_name",
+        "azure_api_type",
+        "system_message",
+        "code_interpreters",
+        "active_block",
+        "headless",
+        "llama_instance",
+        "_executor",
+        "_session",
+        "_procedures_future",
+        "_system_message_cache",
+        "_trimmer",
+        "_response_cache",
+        "_prompt_builder",
+    )
+
     def __init__(self):
         """
         Initializes an instance of the Interpreter class.
@@ -134,11 +598,7 @@ class Interpreter:
         self.azure_api_type = "azure"
 
         # Get default system message
-        here = os.path.abspath(os.path.dirname(__file__))
-        with open(
-            os.path.join(here, "system_message.txt"), "r", encoding="utf8"
-        ) as default_message:
-            self.system_message = default_message.read().strip()
+        self.system_message = _default_system_message()
 
         # Store Code Interpreter instances for each language
         self.code_interpreters = {}
@@ -147,16 +607,54 @@ class Interpreter:
         # (blocks are visual representation of messages on the terminal)
         self.active_block = None
 
+        # Headless: keep track of blocks without displaying them, which skips all
+        # of the rendering (for scripts that use auto_run and read the messages).
+        # Without auto_run, code is printed as plain text before we ask to run it.
+        self.headless = False
+
         # Note: While Open Interpreter can use Llama, we will prioritize gpt-4.
         # gpt-4 is faster, smarter, can call functions, and is all-around easier to use.
         # This makes gpt-4 better aligned with Open Interpreters priority to be easy to use.
         self.llama_instance = None
 
+        # Open Procedures are fetched in the background while we get ready to respond
+        self._executor = None
+        self._session = None
+        self._procedures_future = None
+
+        # The last system message we built, and what we built it from
+        self._system_message_cache = None
+
+        # Remembers how many tokens each message uses, so we don't recount them every turn
+        self._trimmer = MessageTrimmer()
+
+        # Hash of a request -> the assistant message the LLM answered it with
+        self._response_cache = collections.OrderedDict()
+
+        # Remembers the last Code-Llama prompt, so the next one only formats new messages
+        self._prompt_builder = _PromptBuilder()
+
+    @property
+    def model(self):
+        """
+        The model to use, like "gpt-4" (or a Code-Llama or Falcon model, locally).
+        """
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
+        # Falcon models need their own prompt template
+        self._is_falcon = "falcon" in model.lower()
+
     def cli(self):
         """
         Modifies the current instance of Interpreter according to command line flags,
         then runs chat.
         """
+        # Only the command line needs the cli module, so it's imported here
+        from .cli import cli
+
         # The cli takes the current instance of Interpreter,
         # modifies it according to command line flags, then runs chat.
         cli(self)
@@ -166,70 +664,26 @@ class Interpreter:
         Retrieves relevant information for the system message.
         """
 
-        info = ""
-
         # Add user info
-        username = getpass.getuser()
-        current_working_directory = os.getcwd()
-        operating_system = platform.system()
-
-        info += (
-            f"[User Info]\nName: {username}\n"
-            f"CWD: {current_working_directory}\n"
-            f"OS: {operating_system}"
-        )
+        # (the user may `cd` between turns, so look up the directory every time)
+        info = _user_info(os.getcwd())
 
         if not self.local:
             # Open Procedures is an open-source database of tiny,
             # structured coding tutorials.
             # We can query it semantically and append relevant
-            # tutorials/procedures to our system message:
-
-            # Use the last two messages' content or function
-            # call to semantically search
-            query = []
-            for message in self.messages[-2:]:
-                message_for_semantic_search = {"role": message["role"]}
-                if "content" in message:
-                    message_for_semantic_search["content"] = message["content"]
-                if (
-                    "function_call" in message
-                    and "parsed_arguments" in message["function_call"]
-                ):
-                    message_for_semantic_search["function_call"] = message[
-                        "function_call"
-                    ]["parsed_arguments"]
-                query.append(message_for_semantic_search)
-
-            # Use them to query Open Procedures
-            url = "https://open-procedures.replit.app/search/"
+            # tutorials/procedures to our system message.
+            # chat() (or the last function result) usually started this request already.
+            future = self._procedures_future or self._prefetch_procedures()
+            self._procedures_future = None
 
             try:
-                relevant_procedures = requests.get(
-                    url, data=json.dumps(query), timeout=15
-                ).json()["procedures"]
-                info += (
-                    "\n\n# Recommended Procedures\n"
-                    + "\n---\n".join(relevant_procedures)
-                    + "\nIn your plan, include steps and, if present, "
-                    + "**EXACT CODE SNIPPETS** (especially for deprecation notices, "
-                    + "**WRITE THEM INTO YOUR PLAN -- "
-                    + "underneath each numbered step** as they will "
-                    + "VANISH once you execute your first line of code, "
-                    + "so WRITE THEM DOWN NOW if you need them) from the above "
-                    + "procedures if they are relevant to the task. "
-                    + "Again, include **VERBATIM CODE SNIPPETS** from the "
-                    + "procedures above if they are relevent to the task "
-                    + "**directly in your plan.**"
-                )
-            except:
-                # For someone, this failed for a super secure
-                # SSL reason. Since it's not stricly necessary,
-                # let's worry about that another day.
-                # Should probably log this somehow though.
+                info += future.result(timeout=PROCEDURES_WAIT_TIMEOUT)
+            except Exception:
+                # Not strictly necessary, so we go on without them
                 pass
 
-        elif self.local:
+        else:
             # Tell Code-Llama how to run code.
             info += (
                 "\n\nTo run code, write a fenced code block "
@@ -241,12 +695,116 @@ class Interpreter:
 
         return info
 
+    def _prefetch_procedures(self):
+        """
+        Start looking up Open Procedures for the latest messages in the background.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the text to add to the system message.
+        """
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self._procedures_future = self._executor.submit(
+            self._fetch_procedures, self.messages[-2:]
+        )
+        return self._procedures_future
+
+    def _fetch_procedures(self, messages):
+        """
+        Query Open Procedures for procedures relevant to the given messages.
+
+        Args:
+            messages (list): The messages to search with (usually the last two).
+
+        Returns:
+            str: The procedures section for the system message, or "" if there is none.
+        """
+        # Use the messages' content or function call to semantically search
+        query = [_message_for_semantic_search(message) for message in messages]
+
+        # Serialized once, for both the cache key and the request body
+        query_json = dumps_json(query, sort_keys=True)
+
+        # Identical queries (retries, undo and redo, ...) are answered from the cache
+        cache_key = hashlib.sha1(query_json).hexdigest()
+        relevant_procedures = _read_procedures_cache(cache_key)
+
+        if relevant_procedures is None:
+            # Use them to query Open Procedures
+            url = "https://open-procedures.replit.app/search/"
+
+            try:
+                # The search endpoint takes a GET with a JSON body
+                response = self._get_session().get(
+                    url,
+                    data=query_json,
+                    headers={"Content-Type": "application/json"},
+                    timeout=15,
+                )
+                relevant_procedures = loads_json(response.content)["procedures"]
+            except:
+                # For someone, this failed for a super secure
+                # SSL reason. Since it's not stricly necessary,
+                # let's worry about that another day.
+                # Should probably log this somehow though.
+                return ""
+
+            _write_procedures_cache(cache_key, relevant_procedures)
+
+        return (
+            "\n\n# Recommended Procedures\n"
+            + "\n---\n".join(relevant_procedures)
+            + "\nIn your plan, include steps and, if present, "
+            + "**EXACT CODE SNIPPETS** (especially for deprecation notices, "
+            + "**WRITE THEM INTO YOUR PLAN -- "
+            + "underneath each numbered step** as they will "
+            + "VANISH once you execute your first line of code, "
+            + "so WRITE THEM DOWN NOW if you need them) from the above "
+            + "procedures if they are relevant to the task. "
+            + "Again, include **VERBATIM CODE SNIPPETS** from the "
+            + "procedures above if they are relevent to the task "
+            + "**directly in your plan.**"
+        )
+
+    def _get_session(self):
+        """
+        Get the HTTP session, so connections are reused across turns.
+        """
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            session = requests.Session()
+            # One pooled connection per worker that fetches procedures.
+            # Dropped connections and 5xx errors are retried on the same pool,
+            # so a retry doesn't pay for a new TLS handshake.
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=2,
+                max_retries=Retry(
+                    total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504)
+                ),
+            )
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
     def reset(self):
         """
-        Resets the interpreter by clearing messages and code interpreters.
+        Resets the interpreter by clearing messages and code interpreters,
+        and everything remembered from the conversation so far.
         """
         self.messages = []
         self.code_interpreters = {}
+        self._procedures_future = None
+
+        # Otherwise asking the same question again would replay the old answer
+        # (even a function call, which would run its code again)
+        self._response_cache.clear()
+        self._system_message_cache = None
+        self._trimmer = MessageTrimmer()
+        self._prompt_builder = _PromptBuilder()
 
     def load(self, messages):
         """
@@ -270,18 +828,24 @@ class Interpreter:
 
         if len(self.messages) == 0:
             return
+
+        # Undoing is usually for trying again, which should get a new answer
+        self._response_cache.clear()
+
         # Find the index of the last 'role': 'user' entry
+        # (searching from the end, since it's almost always near there)
         last_user_index = None
-        for i, message in enumerate(self.messages):
+        for offset, message in enumerate(reversed(self.messages)):
             if message.get("role") == "user":
-                last_user_index = i
+                last_user_index = len(self.messages) - 1 - offset
+                break
 
         removed_messages = []
 
         # Remove all messages after the last 'role': 'user'
         if last_user_index is not None:
-            removed_messages = self.messages[last_user_index:]
-            self.messages = self.messages[:last_user_index]
+            removed_messages = self.messages[last_user_index:]  # Kept for the preview
+            del self.messages[last_user_index:]  # Truncate in place
 
         print("")  # Aesthetics.
 
@@ -292,7 +856,7 @@ class Interpreter:
                     Markdown(f"**Removed message:** `\"{message['content'][:30]}...\"`")
                 )
             elif "function_call" in message:
-                print(Markdown("**Removed codeblock**"))
+                print(_markdown("**Removed codeblock**"))
 
         print("")  # Aesthetics.
 
@@ -303,37 +867,7 @@ class Interpreter:
         Args:
             arguments: Arguments for help operation. Not used in this method.
         """
-        commands_description = {
-            "%debug [true/false]": "Toggle debug mode. "
-            "Without arguments or with 'true', it enters debug mode. "
-            "With 'false', it exits debug mode.",
-            "%reset": "Resets the current session.",
-            "%undo": "Remove previous messages and its response from the message history.",
-            "%save_message [path]": "Saves messages to a specified JSON path. "
-            "If no path is provided, it defaults to 'messages.json'.",
-            "%load_message [path]": "Loads messages from a specified JSON path. "
-            "If no path is provided, it defaults to 'messages.json'.",
-            "%help": "Show this help message.",
-        }
-
-        base_message = ["> **Available Commands:**\n\n"]
-
-        # Add each command and its description to the message
-        for cmd, desc in commands_description.items():
-            base_message.append(f"- `{cmd}`: {desc}\n")
-
-        additional_info = [
-            (
-                "\n\nFor further assistance, please join our community "
-                "Discord or consider contributing to the "
-                "project's development."
-            )
-        ]
-
-        # Combine the base message with the additional info
-        full_message = base_message + additional_info
-
-        print(Markdown("".join(full_message)))
+        print(_markdown(HELP_MESSAGE))
 
     def handle_debug(self, arguments=None):
         """
@@ -343,14 +877,14 @@ class Interpreter:
             arguments (str): Argument to toggle debug mode. Can be "true" or "false".
         """
         if arguments == "" or arguments == "true":
-            print(Markdown("> Entered debug mode"))
+            print(_markdown("> Entered debug mode"))
             print(self.messages)
             self.debug_mode = True
         elif arguments == "false":
-            print(Markdown("> Exited debug mode"))
+            print(_markdown("> Exited debug mode"))
             self.debug_mode = False
         else:
-            print(Markdown("> Unknown argument to debug command."))
+            print(_markdown("> Unknown argument to debug command."))
 
     def handle_reset(self, arguments):
         """
@@ -360,7 +894,7 @@ class Interpreter:
             arguments: Arguments for reset operation. Not used in this method.
         """
         self.reset()
-        print(Markdown("> Reset Done"))
+        print(_markdown("> Reset Done"))
 
     def default_handle(self, arguments):
         """
@@ -370,22 +904,37 @@ class Interpreter:
         Args:
             arguments: Arguments for default operation. Not used in this method.
         """
-        print(Markdown("> Unknown command"))
+        print(_markdown("> Unknown command"))
         self.handle_help(arguments)
 
     def handle_save_message(self, json_path):
         """
         Saves messages to a specified JSON path.
 
+        Messages are written one at a time, so saving never holds more than one
+        serialized message in memory. Paths ending in `.jsonl` are saved as
+        newline-delimited JSON (one message per line).
+
         Args:
             json_path (str): The path where to save the messages JSON file.
         """
         if json_path == "":
             json_path = "messages.json"
-        if not json_path.endswith(".json"):
+        if not json_path.endswith((".json", ".jsonl")):
             json_path += ".json"
-        with open(json_path, "w", encoding="utf8") as file_save:
-            json.dump(self.messages, file_save, indent=2)
+
+        with open(json_path, "wb") as file_save:
+            if json_path.endswith(".jsonl"):
+                for message in self.messages:
+                    file_save.write(dumps_json(message))
+                    file_save.write(b"\n")
+            else:
+                # A JSON array with one message per line
+                file_save.write(b"[")
+                for i, message in enumerate(self.messages):
+                    file_save.write(b"\n  " if i == 0 else b",\n  ")
+                    file_save.write(dumps_json(message))
+                file_save.write(b"\n]\n")
 
         print(Markdown(f"> messages json export to {os.path.abspath(json_path)}"))
 
@@ -394,14 +943,18 @@ class Interpreter:
         Loads messages from a specified JSON path.
 
         Args:
-            json_path (str): The path from where to load the messages JSON file.
+            json_path (str): The path from where to load the messages JSON
+                (or `.jsonl`) file.
         """
         if json_path == "":
             json_path = "messages.json"
-        if not json_path.endswith(".json"):
+        if not json_path.endswith((".json", ".jsonl")):
             json_path += ".json"
-        with open(json_path, "r", encoding="utf8") as load_message:
-            self.load(json.load(load_message))
+        with open(json_path, "rb") as load_message:
+            if json_path.endswith(".jsonl"):
+                self.load([loads_json(line) for line in load_message if line.strip()])
+            else:
+                self.load(loads_json(load_message.read()))
 
         print(Markdown(f"> messages json loaded from {os.path.abspath(json_path)}"))
 
@@ -413,21 +966,14 @@ class Interpreter:
             user_input (str): The user's input command string.
         """
         # split the command into the command and the arguments, by the first whitespace
-        switch = {
-            "help": self.handle_help,
-            "debug": self.handle_debug,
-            "reset": self.handle_reset,
-            "save_message": self.handle_save_message,
-            "load_message": self.handle_load_message,
-            "undo": self.handle_undo,
-        }
-
         user_input = user_input[1:].strip()  # Capture the part after the `%`
-        command = user_input.split(" ")[0]
-        arguments = user_input[len(command) :].strip()
-        action = switch.get(
-            command, self.default_handle
-        )  # Get the function from the dictionary, or default_handle if not found
+        command, _, arguments = user_input.partition(" ")
+        arguments = arguments.strip()
+        # Get the handle_<command> method, or default_handle if there's no such command
+        if command in COMMAND_NAMES:
+            action = getattr(self, f"handle_{command}")
+        else:
+            action = self.default_handle
         action(arguments)  # Execute the function
 
     def chat(self, message=None, return_messages=False):
@@ -454,6 +1000,8 @@ class Interpreter:
         if self.local:
             # Code-Llama
             if self.llama_instance is None:
+                from .get_hf_llm import get_hf_llm
+
                 # Find or install Code-Llama
                 try:
                     self.llama_instance = get_hf_llm(
@@ -472,7 +1020,7 @@ class Interpreter:
             # If it didn't work, apologize and switch to GPT-4
 
             print(
-                Markdown(
+                _markdown(
                     "".join(
                         [
                             f"> Failed to install `{self.model}`.\n\n",
@@ -497,7 +1045,7 @@ class Interpreter:
                     )
                 )
             )
-            input()
+            _input_without_history()
 
             # Switch to GPT-4
             self.local = False
@@ -505,10 +1053,11 @@ class Interpreter:
             self.verify_api_key()
 
         # Display welcome message
-        welcome_message = ""
+        # (collected as parts, which are joined by newlines)
+        welcome_parts = []
 
         if self.debug_mode:
-            welcome_message += "> Entered debug mode"
+            welcome_parts.append("> Entered debug mode")
 
         # If self.local, we actually don't use self.model
         # (self.auto_run is like advanced usage, we display no messages)
@@ -517,38 +1066,42 @@ class Interpreter:
                 notice_model = f"{self.azure_deployment_name} (Azure)"
             else:
                 notice_model = f"{self.model.upper()}"
-            welcome_message += (
-                f"\n> Model set to `{notice_model}`\n\n"
+            welcome_parts.append(
+                f"> Model set to `{notice_model}`\n\n"
                 f"**Tip:** To run locally, use `interpreter --local`"
             )
 
         if self.local:
-            welcome_message += f"\n> Model set to `{self.model}`"
+            welcome_parts.append(f"> Model set to `{self.model}`")
 
         # If not auto_run, tell the user we'll ask permission to run code
         # We also tell them here how to exit Open Interpreter
         if not self.auto_run:
-            welcome_message += "\n\n" + CONFIRM_MODE_MESSAGE
+            welcome_parts.append("\n" + CONFIRM_MODE_MESSAGE)
 
-        welcome_message = welcome_message.strip()
+        welcome_message = "\n".join(welcome_parts).strip()
 
         # Print welcome message with newlines on either side (aesthetic choice)
         # unless we're starting with a blockquote (aesthetic choice)
         if welcome_message != "":
             if welcome_message.startswith(">"):
-                print(Markdown(welcome_message), "")
+                print(_markdown(welcome_message), "")
             else:
-                print("", Markdown(welcome_message), "")
+                print("", _markdown(welcome_message), "")
 
         # Check if `message` was passed in by user
         if message:
             # If it was, we respond non-interactivley
-            self.messages.append({'content': ''})
             self.messages.append({"role": "user", "content": message})
+            if not self.local:
+                self._prefetch_procedures()
             self.respond()
 
         else:
-            # If it wasn't, we start an interactive chat
+            # If it wasn't, we start an interactive chat.
+            # (With `readline` imported, input() adds each line to the history,
+            # so users can up-arrow to previous messages, as in a terminal.)
+            _init_readline()
             while True:
                 try:
                     user_input = input("> ").strip()
@@ -558,18 +1111,16 @@ class Interpreter:
                     print()  # Aesthetic choice
                     break
 
-                # Use `readline` to let users up-arrow to previous user messages,
-                # which is a common behavior in terminals.
-                readline.add_history(user_input)
-
                 # If the user input starts with a `%` or `/`, it's a command
                 if user_input.startswith("%") or user_input.startswith("/"):
                     self.handle_command(user_input)
                     continue
 
                 # Add the user message to self.messages
-                self.messages.append({'content': ''})
                 self.messages.append({"role": "user", "content": user_input})
+                if not self.local:
+                    # Look up Open Procedures while we get ready to respond
+                    self._prefetch_procedures()
 
                 # Respond, but gracefully handle CTRL-C / KeyboardInterrupt
                 try:
@@ -587,9 +1138,7 @@ class Interpreter:
         """
         Makes sure we have an AZURE_API_KEY or OPENAI_API_KEY.
         """
-
-        # Initialize response
-        response = None
+        import litellm
 
         if self.use_azure:
             all_env_available = (
@@ -608,79 +1157,29 @@ class Interpreter:
                 self.azure_api_type = os.environ.get("AZURE_API_TYPE", "azure")
             else:
                 # This is probably their first time here!
-                self._print_welcome_message()
-                time.sleep(1)
-
-                print(Rule(style="white"))
-
-                print(Markdown(MISSING_AZURE_INFO_MESSAGE), "", Rule(style="white"), "")
-                response = input("Azure OpenAI API key: ")
+                response = self._prompt_for_api_key(
+                    MISSING_AZURE_INFO_MESSAGE, "Azure OpenAI API key: "
+                )
 
                 if response == "":
                     # User pressed `enter`, requesting Code-Llama
-
-                    print(
-                        Markdown(
-                            "> Switching to `Code-Llama`...\n\n"
-                            "**Tip:** Run `interpreter --local` to "
-                            "automatically use `Code-Llama`."
-                        ),
-                        "",
-                    )
-                    time.sleep(2)
-                    print(Rule(style="white"))
-
-                    # Temporarily, for backwards (behavioral) compatability,
-                    # we've moved this part of llama_2.py here.
-                    # AND BELOW.
-                    # This way, when folks hit interpreter --local,
-                    # they get the same experience as before.
-
-                    print(
-                        "",
-                        Markdown(
-                            "**Open Interpreter** will use `Code Llama` for local execution. "
-                            "Use your arrow keys to set up the model."
-                        ),
-                        "",
-                    )
-
-                    models = {
-                        "7B": "TheBloke/CodeLlama-7B-Instruct-GGUF",
-                        "13B": "TheBloke/CodeLlama-13B-Instruct-GGUF",
-                        "34B": "TheBloke/CodeLlama-34B-Instruct-GGUF",
-                    }
-
-                    parameter_choices = list(models.keys())
-                    questions = [
-                        inquirer.List(
-                            "param",
-                            message="Parameter count (smaller is faster, larger is more capable)",
-                            choices=parameter_choices,
-                        )
-                    ]
-                    answers = inquirer.prompt(questions)
-                    if answers is not None:
-                        chosen_param = answers["param"]
-
-                        # THIS is more in line with the future.
-                        # You just say the model you want by name:
-                        self.model = models[chosen_param]
-                        self.local = True
-                    else:
-                        print("No answer provided. Please try again.")
+                    self._switch_to_code_llama()
                     return
 
                 else:
                     self.api_key = response
-                    self.azure_api_base = input("Azure OpenAI API base: ")
-                    self.azure_deployment_name = input(
+                    self.azure_api_base = _input_without_history(
+                        "Azure OpenAI API base: "
+                    )
+                    self.azure_deployment_name = _input_without_history(
                         "Azure OpenAI deployment name of GPT: "
                     )
-                    self.azure_api_version = input("Azure OpenAI API version: ")
+                    self.azure_api_version = _input_without_history(
+                        "Azure OpenAI API version: "
+                    )
                     print(
                         "",
-                        Markdown(
+                        _markdown(
                             "**Tip:** To save this key for later, "
                             "run `export AZURE_API_KEY=your_api_key "
                             "AZURE_API_BASE=your_api_base "
@@ -708,81 +1207,20 @@ class Interpreter:
                     self.api_key = os.environ["OPENAI_API_KEY"]
                 else:
                     # This is probably their first time here!
-                    self._print_welcome_message()
-                    time.sleep(1)
-
-                    print(Rule(style="white"))
-
-                    print(
-                        Markdown(MISSING_API_KEY_MESSAGE), "", Rule(style="white"), ""
+                    response = self._prompt_for_api_key(
+                        MISSING_API_KEY_MESSAGE, "OpenAI API key: "
                     )
-                    response = input("OpenAI API key: ")
 
                     if response == "":
                         # User pressed `enter`, requesting Code-Llama
-
-                        print(
-                            Markdown(
-                                "> Switching to `Code-Llama`...\n\n**"
-                                "Tip:** Run `interpreter --local` "
-                                "to automatically use `Code-Llama`."
-                            ),
-                            "",
-                        )
-                        time.sleep(2)
-                        print(Rule(style="white"))
-
-                        # Temporarily, for backwards (behavioral) compatability,
-                        # we've moved this part of llama_2.py here.
-                        # AND ABOVE.
-                        # This way, when folks hit interpreter --local,
-                        # they get the same experience as before.
-
-                        print(
-                            "",
-                            Markdown(
-                                "**Open Interpreter** will use `Code Llama` "
-                                "for local execution. "
-                                "Use your arrow keys to set up the model."
-                            ),
-                            "",
-                        )
-
-                        models = {
-                            "7B": "TheBloke/CodeLlama-7B-Instruct-GGUF",
-                            "13B": "TheBloke/CodeLlama-13B-Instruct-GGUF",
-                            "34B": "TheBloke/CodeLlama-34B-Instruct-GGUF",
-                        }
-
-                        parameter_choices = list(models.keys())
-                        questions = [
-                            inquirer.List(
-                                "param",
-                                message=(
-                                    "Parameter count: smaller is faster, "
-                                    "larger is more capable)"
-                                ),
-                                choices=parameter_choices,
-                            )
-                        ]
-                        answers = inquirer.prompt(questions)
-                        if answers is not None:
-                            chosen_param = answers["param"]
-                        else:
-                            chosen_param = "7B"  # Or any other default value
-
-                        # THIS is more in line with the future.
-                        # You just say the model you want by name:
-                        self.model = models[chosen_param]
-                        self.local = True
-
+                        self._switch_to_code_llama(default_param="7B")
                         return
 
                     else:
                         self.api_key = response
                         print(
                             "",
-                            Markdown(
+                            _markdown(
                                 "**Tip:** To save this key for later, "
                                 "run `export OPENAI_API_KEY=your_api_key` "
                                 "on Mac/Linux or `setx OPENAI_API_KEY your_api_key` "
@@ -797,6 +1235,76 @@ class Interpreter:
             if self.api_base:
                 litellm.api_base = self.api_base
 
+    def _prompt_for_api_key(self, missing_message, prompt):
+        """
+        Welcomes a (probably new) user, explains what's missing and asks for an API key.
+
+        Args:
+            missing_message (str): Markdown explaining which API info wasn't found.
+            prompt (str): The prompt for the API key input.
+
+        Returns:
+            str: What the user entered ("" means they'd like to use Code-Llama).
+        """
+        self._print_welcome_message()
+        time.sleep(1)
+
+        print(Rule(style="white"))
+
+        print(_markdown(missing_message), "", Rule(style="white"), "")
+        # Keep the key out of the input history, which is saved to disk
+        return _input_without_history(prompt)
+
+    def _switch_to_code_llama(self, default_param=None):
+        """
+        Switches to a local Code-Llama model, asking the user which size to use.
+
+        Args:
+            default_param (str, optional): The size to use if the user doesn't pick
+                one. Without it, we stay on the current model.
+        """
+        from .cli import prompt_choice
+
+        print(
+            _markdown(
+                "> Switching to `Code-Llama`...\n\n"
+                "**Tip:** Run `interpreter --local` to "
+                "automatically use `Code-Llama`."
+            ),
+            "",
+        )
+        time.sleep(2)
+        print(Rule(style="white"))
+
+        # Temporarily, for backwards (behavioral) compatability,
+        # we've moved this part of llama_2.py here.
+        # This way, when folks hit interpreter --local,
+        # they get the same experience as before.
+
+        print(
+            "",
+            _markdown(
+                "**Open Interpreter** will use `Code Llama` for local execution. "
+                "Pick a model size below."
+            ),
+            "",
+        )
+
+        chosen_param = prompt_choice(
+            "Parameter count (smaller is faster, larger is more capable)",
+            list(LLAMA_MODELS),
+        )
+        if chosen_param is None:
+            if default_param is None:
+                print("No answer provided. Please try again.")
+                return
+            chosen_param = default_param
+
+        # THIS is more in line with the future.
+        # You just say the model you want by name:
+        self.model = LLAMA_MODELS[chosen_param]
+        self.local = True
+
     def end_active_block(self):
         """
         Ends the currently active block.
@@ -805,43 +1313,107 @@ class Interpreter:
             self.active_block.end()
             self.active_block = None
 
+    def _get_code_interpreter(self, language):
+        """
+        Returns the Code Interpreter for a language, creating it if needed.
+        """
+        code_interpreter = self.code_interpreters.get(language)
+        if code_interpreter is None:
+            code_interpreter = CodeInterpreter(language, self.debug_mode)
+            self.code_interpreters[language] = code_interpreter
+        return code_interpreter
+
+    def _build_system_message(self, info):
+        """
+        Combines the system message with the info for this turn.
+
+        The result is remembered, so turns where nothing changed
+        (which is most of them when running locally) skip the rebuild.
+
+        Args:
+            info (str): The info from get_info_for_system_message().
+
+        Returns:
+            str: The system message to send.
+        """
+        if self.local:
+            # (Shortening an already short system message gives it back unchanged)
+            self.system_message = _local_system_message(self.system_message)
+
+        key = (self.system_message, info)
+        cached = self._system_message_cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        system_message = self.system_message + "\n\n" + info
+
+        self._system_message_cache = (key, system_message)
+        return system_message
+
     def respond(self):
         """
         Responds to the most recent message in the messages list.
         """
+        # Each response that runs code is followed by another one,
+        # which sees the code's output
+        while self._respond_once():
+            pass
+
+    def _respond_once(self):
+        """
+        Streams one response from the LLM, and runs the code it asks to run.
+
+        Returns:
+            bool: Whether the LLM should respond again (to the code's output).
+        """
+
+        import litellm
+        import tokentrim as tt
 
         # Initialize response
         response = None
 
+        # Set if this response may be cached
+        cache_key = None
+
         # Add relevant info to system_message
         # (e.g. current working directory, username, os, etc.)
         info = self.get_info_for_system_message()
 
-        # This is hacky, as we should have a different (minified) prompt for CodeLLama,
-        # but for now, to make the prompt shorter and remove "run_code" references,
-        # just get the first 2 lines:
-        if self.local:
-            self.system_message = "\n".join(self.system_message.split("\n")[:2])
-            self.system_message += (
-                "\nOnly do what the user asks you to do, "
-                "then ask what they'd like to do next."
-            )
-
-        system_message = self.system_message + "\n\n" + info
+        system_message = self._build_system_message(info)
 
         if self.local:
-            messages = tt.trim(
-                self.messages,
-                max_tokens=(self.context_window - self.max_tokens - 25),
-                system_message=system_message,
+            max_tokens = self.context_window - self.max_tokens - 25
+            messages = self._trimmer.trim(
+                self.messages, system_message, max_tokens=max_tokens
             )
+            if messages is None:
+                messages = tt.trim(
+                    self.messages, max_tokens=max_tokens, system_message=system_message
+                )
         else:
-            messages = tt.trim(self.messages, self.model, system_message=system_message)
+            messages = self._trimmer.trim(self.messages, system_message, self.model)
+            if messages is None:
+                messages = tt.trim(
+                    self.messages, self.model, system_message=system_message
+                )
+
+            # Send the system message and this turn's info as separate messages.
+            # The system message then starts every request byte-for-byte the same,
+            # so providers that cache prompt prefixes can reuse it across turns.
+            # (Unless tokentrim had to shorten it, in which case we leave it be.)
+            if messages and messages[0].get("content") == system_message:
+                messages[0:1] = [
+                    {"role": "system", "content": self.system_message},
+                    {"role": "system", "content": info},
+                ]
 
         if self.debug_mode:
-            print("\n", "Sending `messages` to LLM:", "\n")
-            print(messages)
-            print()
+            # builtins.print, because rich.print pretty-prints (slow for a long
+            # history) and reads things like "[INST]" in messages as markup
+            builtins.print("\n", "Sending `messages` to LLM:", "\n")
+            builtins.print(messages)
+            builtins.print()
 
         # Make LLM call
         if not self.local:
@@ -849,108 +1421,95 @@ class Interpreter:
 
             error = ""
 
-            self.messages.append({})  # Add empty message dict
-            self.messages.append({'content': ''})
+            # Retrying won't fix these (litellm's errors subclass openai's)
+            from openai import error as openai_error
 
-            # New code to check and add 'content'
-            if "content" not in self.messages[-1]:
-                self.messages[-1]["content"] = ""
+            non_retryable_errors = (
+                openai_error.AuthenticationError,
+                openai_error.InvalidRequestError,
+                openai_error.PermissionError,
+            )
 
-            for _ in range(3):  # 3 retries
-                try:
-                    if self.use_azure:
-                        if isinstance(messages, tuple):
-                            messages = messages[0]
-                            response = litellm.completion(
-                                f"azure/{self.azure_deployment_name}",
-                                messages=messages,
-                                functions=[function_schema],
-                                temperature=self.temperature,
-                                stream=True,
-                            )
-                    else:
-                        if self.api_base:
-                            if isinstance(messages, tuple):
-                                messages = messages[0]
-                                # The user set the api_base.
-                                # litellm needs this to be "custom/{model}"
-                                response = litellm.completion(
-                                    api_base=self.api_base,
-                                    model="custom/" + self.model,
-                                    messages=messages,
-                                    functions=[function_schema],
-                                    stream=True,
-                                    temperature=self.temperature,
-                                )
-                        else:
-                            if isinstance(messages, tuple):
-                                messages = messages[0]
-                                # Normal OpenAI call
-                                response = litellm.completion(
-                                    model=self.model,
-                                    messages=messages,
-                                    functions=[function_schema],
-                                    stream=True,
-                                    temperature=self.temperature,
-                                )
-                    break
-                except:
-                    if self.debug_mode:
-                        traceback.print_exc()
-                    error = traceback.format_exc()
-                    time.sleep(3)
+            # tokentrim can return (messages, response_tokens)
+            if isinstance(messages, tuple):
+                messages = messages[0]
+
+            completion_kwargs = {
+                "messages": messages,
+                "functions": [function_schema],
+                "stream": True,
+                "temperature": self.temperature,
+            }
+            if self.use_azure:
+                completion_kwargs["model"] = f"azure/{self.azure_deployment_name}"
+            elif self.api_base:
+                # The user set the api_base.
+                # litellm needs this to be "custom/{model}"
+                completion_kwargs["api_base"] = self.api_base
+                completion_kwargs["model"] = "custom/" + self.model
+            else:
+                # Normal OpenAI call
+                completion_kwargs["model"] = self.model
+
+            # Asking exactly the same thing again (e.g. a script that clears
+            # the messages and asks again) gets the same answer, without waiting
+            # on the LLM. Only at temperature 0: otherwise a fresh sample is wanted.
+            # Once code has run, the answer depends on what that code did
+            # to the machine, so those conversations are never cached
+            # (even if trimming dropped the function results from the request).
+            if self.temperature == 0 and not any(
+                message.get("role") == "function" for message in self.messages
+            ):
+                cache_key = hashlib.blake2b(
+                    dumps_json(completion_kwargs, sort_keys=True)
+                ).hexdigest()
+
+            cached_message = self._response_cache.get(cache_key)
+            if cached_message is not None:
+                self._response_cache.move_to_end(cache_key)
+                response = [
+                    {
+                        "choices": [
+                            {
+                                "delta": _message_for_response_cache(cached_message),
+                                "finish_reason": "stop",
+                            }
+                        ]
+                    }
+                ]
             else:
-                raise Exception(error)
+                for attempt in range(LLM_ATTEMPTS):
+                    try:
+                        response = litellm.completion(**completion_kwargs)
+                        break
+                    except non_retryable_errors:
+                        raise
+                    except Exception as e:
+                        # The same goes for other client errors (not found, ...)
+                        status = getattr(e, "http_status", None)
+                        if (
+                            status is not None
+                            and 400 <= status < 500
+                            and status not in LLM_RETRYABLE_CLIENT_ERRORS
+                        ):
+                            raise
+                        if self.debug_mode:
+                            traceback.print_exc()
+                        error = traceback.format_exc()
+                        if attempt < LLM_ATTEMPTS - 1:
+                            delay = min(
+                                LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2**attempt
+                            )
+                            time.sleep(random.uniform(0, delay))
+                else:
+                    raise Exception(error)
 
         elif self.local:
             # Code-Llama
 
             # Convert messages to prompt
             # (This only works if the first message is the only system message)
-
-            def messages_to_prompt(messages):
-                for message in messages:
-                    # Happens if it immediatly writes code
-                    if "role" not in message:
-                        message["role"] = "assistant"
-
-                # Falcon prompt template
-                if "falcon" in self.model.lower():
-                    formatted_messages = ""
-                    for message in messages:
-                        formatted_messages += (
-                            f"{message['role'].capitalize()}: {message['content']}\n"
-                        )
-                    formatted_messages = formatted_messages.strip()
-
-                else:
-                    # Llama prompt template
-
-                    # Extracting the system prompt and initializing the formatted string with it.
-                    system_prompt = messages[0]["content"]
-                    formatted_messages = (
-                        f"<s>[INST] <<SYS>>\n{system_prompt}\n<</SYS>>\n"
-                    )
-
-                    # Loop starting from the first user message
-                    for index, item in enumerate(messages[1:]):
-                        role = item["role"]
-                        content = item["content"]
-
-                        if role == "user":
-                            formatted_messages += f"{content} [/INST] "
-                        elif role == "function":
-                            formatted_messages += f"Output: {content} [/INST] "
-                        elif role == "assistant":
-                            formatted_messages += f"{content} </s><s>[INST] "
-
-                    # Remove the trailing '<s>[INST] ' from the final output
-                    if formatted_messages.endswith("<s>[INST] "):
-                        formatted_messages = formatted_messages[:-10]
-
-                return formatted_messages
-
-            prompt = messages_to_prompt(messages)
+            prompt = self._prompt_builder.build(messages, self._is_falcon)
             # Lmao i can't believe this works (it does need this btw)
             if isinstance(messages[-1], dict):
                 if messages[-1]["role"] != "function":
@@ -998,64 +1557,58 @@ class Interpreter:
                 raise ValueError("Failed to initialize llama instance")
 
         # Initialize message, function call trackers, and active block
-        self.messages.append({'content': ''})
+        # (Code-Llama won't send a role, so we add it. GPT's first delta will.)
+        if self.local:
+            self.messages.append({"role": "assistant", "content": ""})
+        else:
+            self.messages.append({"content": ""})
         in_function_call = False
         llama_function_call_finished = False
         self.active_block = None
 
+        # Code-Llama's code blocks are fenced with "```"
+        code_fences = CodeFenceParser()
+
+        # The language whose interpreter we've started ahead of time
+        prewarmed_language = None
+
+        # GPT's function call arguments are parsed as they stream in
+        arguments_parser = StringObjectParser()
+        arguments_parsed = 0  # How much of the arguments the parser has seen
+        # (and if they turn out to be other JSON, this parses them instead)
+        json_parser = PartialJSONParser()
+
         if response is None or not hasattr(response, "__iter__"):
             raise ValueError("Response is either None or not iterable")
         else:
-            for chunk in response:
-                if self.use_azure and (
-                    "choices" not in chunk or len(chunk["choices"]) == 0
-                ):
-                    # Azure OpenAI Service may return empty chunk
-                    continue
+            local = self.local
 
-                # Initialize condition with a default value
-                condition = False
-
-                if self.local:
-                    # Check if messages[-1] is a dictionary
-                    if isinstance(messages[-1], dict):
-                        if "content" not in messages[-1]:
-                            # This is the first chunk. We'll need to capitalize it,
-                            # because our prompt ends in a ", "
-                            chunk["choices"][0]["text"] = chunk["choices"][0][
-                                "text"
-                            ].capitalize()
-                            # We'll also need to add "role: assistant",
-                            # CodeLlama will not generate this
-                            messages[-1]["role"] = "assistant"
-                        delta = {"content": chunk["choices"][0]["text"]}
-                    else:
-                        delta = chunk["choices"][0]["delta"]
+            # Handle chunks in batches, so we don't parse and redraw on every token.
+            # (This also skips the empty chunks Azure OpenAI Service may send.)
+            for chunk in coalesce_chunks(response):
+                choice = chunk["choices"][0]
+                finish_reason = choice["finish_reason"]
+
+                if local:
+                    # Code-Llama sends text, not deltas
+                    delta = {"content": choice["text"]}
                 else:
-                    delta = chunk["choices"][0]["delta"]
+                    delta = choice["delta"]
 
                 # Accumulate deltas into the last message in messages
-                self.messages[-1] = merge_deltas(self.messages[-1], delta)
-
-                # Check if 'content' exists in the updated message
-                if "content" not in self.messages[-1]:
-                    # If not, initialize it with an empty string
-                    self.messages[-1]["content"] = ""
+                # (and keep it in a local, it's used a lot below)
+                message = merge_deltas(self.messages[-1], delta)
+                self.messages[-1] = message
 
                 # Check if we're in a function call
-                if not self.local:
-                    condition = "function_call" in self.messages[-1]
-                elif self.local:
+                if not local:
+                    condition = "function_call" in message
+                else:
                     # Since Code-Llama can't call functions,
                     # we just check if we're in a code block.
                     # This simply returns true if the number of
                     # "```" in the message is odd.
-                    if "content" in self.messages[-1]:
-                        condition = self.messages[-1]["content"].count("```") % 2 == 1
-                    elif self.local:
-                        # If it hasn't made "content" yet,
-                        # we're certainly not in a function call.
-                        condition = False
+                    condition = code_fences.update(message["content"])
 
                 if condition:
                     # We are in a function call.
@@ -1068,91 +1621,72 @@ class Interpreter:
                         # Print newline if it was just a code block or user message
                         # (this just looks nice)
                         last_role = self.messages[-2]["role"]
-                        if last_role == "user" or last_role == "function":
+                        if not self.headless and last_role in ("user", "function"):
                             print()
 
                         # then create a new code block
-                        self.active_block = CodeBlock()
+                        if self.headless:
+                            self.active_block = HeadlessCodeBlock()
+                        else:
+                            self.active_block = CodeBlock()
 
                     # Remember we're in a function_call
                     in_function_call = True
 
                     # Now let's parse the function's arguments:
 
-                    if not self.local:
+                    if not local:
                         # gpt-4
                         # Parse arguments and save to parsed_arguments, under function_call
-                        if "arguments" in self.messages[-1]["function_call"]:
-                            arguments = self.messages[-1]["function_call"]["arguments"]
-                            new_parsed_arguments = parse_partial_json(arguments)
+                        function_call = message["function_call"]
+                        arguments = function_call.get("arguments")
+                        # Only parse when there's something new since the last chunk
+                        if arguments and len(arguments) > arguments_parsed:
+                            new_parsed_arguments = arguments_parser.feed(
+                                arguments[arguments_parsed:]
+                            )
+                            arguments_parsed = len(arguments)
+                            if new_parsed_arguments is None:
+                                # They're not the JSON we expected. Try harder.
+                                new_parsed_arguments = json_parser.parse(arguments)
                             if new_parsed_arguments:
                                 # Only overwrite what we have if it's not None
                                 # (which means it failed to parse)
-                                self.messages[-1]["function_call"][
-                                    "parsed_arguments"
-                                ] = new_parsed_arguments
+                                function_call["parsed_arguments"] = new_parsed_arguments
 
-                    elif self.local:
+                    else:
                         # Code-Llama
                         # Parse current code block and save to parsed_arguments,
                         # under function_call
 
-                        # Initialize arguments with a default value
-                        arguments = {}
-
-                        if "content" in self.messages[-1]:
-                            content = self.messages[-1]["content"]
-
-                            if "```" in content:
-                                # Split by "```" to get the last open code block
-                                blocks = content.split("```")
-
-                                current_code_block = blocks[-1]
-
-                                lines = current_code_block.split("\n")
-
-                                if (
-                                    content.strip() == "```"
-                                ):  # Hasn't outputted a language yet
-                                    language = None
-                                else:
-                                    if lines[0] != "":
-                                        language = lines[0].strip()
-                                    else:
-                                        language = "python"
-                                        # In anticipation of its dumbassery let's check
-                                        # if "pip" is in there
-                                        if len(lines) > 1:
-                                            if lines[1].startswith("pip"):
-                                                language = "shell"
-
-                                # Join all lines except for the language line
-                                code = "\n".join(lines[1:]).strip("` \n")
-
-                                arguments = {"code": code}
-                                if (
-                                    language
-                                ):  # We only add this if we have it-- the second we have it,
-                                    # an interpreter gets fired up (I think? maybe I'm wrong)
-                                    if language == "bash":
-                                        language = "shell"
-                                    arguments["language"] = language
-
-                            # Code-Llama won't make a "function_call" property
-                            # for us to store this under, so:
-                            if "function_call" not in self.messages[-1]:
-                                self.messages[-1]["function_call"] = {}
-
-                            self.messages[-1]["function_call"][
-                                "parsed_arguments"
-                            ] = arguments
+                        arguments = code_fences.arguments(message["content"])
+
+                        # Code-Llama won't make a "function_call" property
+                        # for us to store this under, so:
+                        if "function_call" not in message:
+                            message["function_call"] = {}
+
+                        message["function_call"]["parsed_arguments"] = arguments
+
+                    # Start the language's interpreter as soon as we know the language,
+                    # so it's ready by the time the code is (and the user confirms it)
+                    if prewarmed_language is None:
+                        language = (
+                            message["function_call"]
+                            .get("parsed_arguments", {})
+                            .get("language")
+                        )
+                        # (A language we don't know may still be streaming in)
+                        if language in language_map:
+                            self._get_code_interpreter(language).prewarm()
+                            prewarmed_language = language
 
                 else:
                     # We are not in a function call.
 
                     # Check if we just left a function call
                     if in_function_call is True:
-                        if self.local:
+                        if local:
                             # This is the same as when gpt-4 gives finish_reason as function_call.
                             # We have just finished a code block, so now we should run it.
                             llama_function_call_finished = True
@@ -1163,25 +1697,31 @@ class Interpreter:
                     # If there's no active block,
                     if self.active_block is None:
                         # Create a message block
-                        self.active_block = MessageBlock()
+                        if self.headless:
+                            self.active_block = HeadlessMessageBlock()
+                        else:
+                            self.active_block = MessageBlock()
 
                 # Update active_block
                 if self.active_block is not None:
-                    self.active_block.update_from_message(self.messages[-1])
+                    self.active_block.update_from_message(message)
 
                 # Check if we're finished
-                if chunk["choices"][0]["finish_reason"] or llama_function_call_finished:
-                    if (
-                        chunk["choices"][0]["finish_reason"] == "function_call"
-                        or llama_function_call_finished
-                    ):
+                if finish_reason or llama_function_call_finished:
+                    # Remember complete text answers. (Not ones cut off by the token
+                    # limit, and not function calls: replaying one would run its
+                    # code again without the LLM deciding to.)
+                    if cache_key is not None and finish_reason == "stop":
+                        self._cache_response(cache_key, message)
+
+                    if finish_reason == "function_call" or llama_function_call_finished:
                         # Time to call the function!
                         # (Because this is Open Interpreter, we only have one function.)
 
                         if self.debug_mode:
-                            print("Running function:")
-                            print(self.messages[-1])
-                            print("---")
+                            builtins.print("Running function:")
+                            builtins.print(self.messages[-1])
+                            builtins.print("---")
 
                         # Ask for user confirmation to run code
                         if self.auto_run is False:
@@ -1191,8 +1731,13 @@ class Interpreter:
                                 language = self.active_block.language
                                 code = self.active_block.code
 
+                                # A headless block never showed the code, so show
+                                # it plainly before asking about it
+                                if self.headless:
+                                    builtins.print(f"\n  {language}:\n\n{code}\n")
+
                             # Prompt user
-                            response = input(
+                            response = _input_without_history(
                                 "  Would you like to run this code? (y/n)\n\n  "
                             )
                             print("")  # <- Aesthetic choice
@@ -1208,6 +1753,11 @@ class Interpreter:
                                 # User declined to run code.
                                 if self.active_block is not None:
                                     self.active_block.end()
+                                # Stop the interpreter we started for it ahead of time
+                                if prewarmed_language is not None:
+                                    self._get_code_interpreter(
+                                        prewarmed_language
+                                    ).cancel_prewarm()
                                 self.messages.append(
                                     {
                                         "role": "function",
@@ -1219,7 +1769,7 @@ class Interpreter:
 
                         # If we couldn't parse its arguments, we need to try again.
                         if (
-                            not self.local
+                            not local
                             and "parsed_arguments"
                             not in self.messages[-1]["function_call"]
                         ):
@@ -1251,27 +1801,18 @@ class Interpreter:
                                 }
                             )
 
-                            self.respond()
-                            return
+                            return True
 
                         # Create or retrieve a Code Interpreter for this language
                         language = self.messages[-1]["function_call"][
                             "parsed_arguments"
                         ]["language"]
-                        if language not in self.code_interpreters:
-                            self.code_interpreters[language] = CodeInterpreter(
-                                language, self.debug_mode
-                            )
-                        code_interpreter = self.code_interpreters[language]
+                        code_interpreter = self._get_code_interpreter(language)
 
                         # Let this Code Interpreter control the active_block
                         code_interpreter.active_block = self.active_block
                         code_interpreter.run()
 
-                        # End the active_block
-                        if self.active_block is not None:
-                            self.active_block.end()
-
                         # Append the output to messages
                         # Explicitly tell it if there was no output
                         # (sometimes "" = hallucinates output)
@@ -1285,15 +1826,24 @@ class Interpreter:
                             }
                         )
 
+                        # The next response is built from these messages, so start
+                        # looking up Open Procedures for it while we end the block
+                        if not local:
+                            self._prefetch_procedures()
+
+                        # End the active_block
+                        if self.active_block is not None:
+                            self.active_block.end()
+
                         # Go around again
-                        self.respond()
+                        return True
 
-                    if chunk["choices"][0]["finish_reason"] != "function_call":
+                    if finish_reason != "function_call":
                         # Done!
 
                         # Code Llama likes to output "###"
                         # at the end of every message for some reason
-                        if self.local and "content" in self.messages[-1]:
+                        if local:
                             self.messages[-1]["content"] = (
                                 self.messages[-1]["content"].strip().rstrip("#")
                             )
@@ -1303,10 +1853,27 @@ class Interpreter:
                                 self.active_block.end()
                         return
 
+    def _cache_response(self, cache_key, message):
+        """
+        Remember the text answer the LLM gave to a request.
+
+        Args:
+            cache_key (str): The hash of the request.
+            message (dict): The complete assistant message (without a function call).
+        """
+        self._response_cache[cache_key] = _message_for_response_cache(message)
+        self._response_cache.move_to_end(cache_key)
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+
     def _print_welcome_message(self):
         """
         Prints a welcome message for the user.
         """
         print(
-            "", Markdown("●"), "", Markdown("\nWelcome to **Open Interpreter**.\n"), ""
+            "",
+            _markdown("●"),
+            "",
+            _markdown("\nWelcome to **Open Interpreter**.\n"),
+            "",
         )
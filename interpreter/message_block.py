@@ -11,16 +11,24 @@ and distinguishing code blocks from Markdown code formatting.
 
 Key Components:
 - MessageBlock: Main class to display message content.
+- HeadlessMessageBlock: A MessageBlock that displays nothing (headless mode).
 - textify_markdown_code_blocks: Utility to avoid style collision.
 
 """
 import re
+import time
 from rich.console import Console
 from rich.live import Live
 from rich.panel import Panel
 from rich.markdown import Markdown
 from rich.box import MINIMAL
 
+# The end of a line that opens or closes a markdown code block: ``` and an optional
+# language. ([^\S\n] is any whitespace but a newline, like line.strip() removes.)
+# Only whitespace may come before it on the line, which the caller checks: the regex
+# engine only finds a pattern quickly when the pattern starts with a literal.
+_FENCE_PATTERN = re.compile(r"```\w*[^\S\n]*$", re.MULTILINE)
+
 
 class MessageBlock:
     """
@@ -35,6 +43,7 @@ class MessageBlock:
     Attributes:
         live: An instance of Rich's Live class for live-updating the message panel.
         content: The content of the message to be displayed.
+        min_refresh_interval (float): Minimum seconds between streamed redraws.
 
     Methods:
         update_from_message(message): Update the message content and refresh the display.
@@ -50,6 +59,9 @@ class MessageBlock:
 
     """
 
+    # Redraw at most ~30 times a second while the message is streaming in
+    min_refresh_interval = 1 / 30
+
     def __init__(self):
         """
         Initialize a new MessageBlock instance.
@@ -58,6 +70,12 @@ class MessageBlock:
         self.live.start()
         self.content = ""
         self.output = ""
+        self._last_refresh = 0.0
+
+        # The complete lines of content we've textified so far, and the result
+        self._textified_source = ""
+        self._textified = ""
+        self._inside_code_block = False
 
     def update_from_message(self, message):
         """
@@ -70,8 +88,18 @@ class MessageBlock:
             None
 
         """
-        self.content = message.get("content", "")
-        if self.content:
+        content = message.get("content")
+        if not content or content == self.content:
+            # Nothing (new) to show, e.g. the delta was for another field
+            return
+
+        self.content = content
+        # Every redraw re-renders all of the Markdown so far, so skip redraws
+        # that come faster than the eye can follow.
+        # end() always draws the final state.
+        now = time.monotonic()
+        if now - self._last_refresh >= self.min_refresh_interval:
+            self._last_refresh = now
             self.refresh()
 
     def end(self):
@@ -100,7 +128,7 @@ class MessageBlock:
         """
         # De-stylize any code blocks in markdown,
         # to differentiate from our Code Blocks
-        content = textify_markdown_code_blocks(self.content)
+        content = self._textify(self.content)
 
         if cursor:
             content += "█"
@@ -110,6 +138,62 @@ class MessageBlock:
         self.live.update(panel)
         self.live.refresh()
 
+    def _textify(self, content):
+        """
+        Same as textify_markdown_code_blocks(content), but only processes what's
+        new since the last call: lines that were complete then are remembered.
+
+        Args:
+            content (str): The content, usually the last call's plus more.
+
+        Returns:
+            str: The content with its markdown code blocks made text code blocks.
+        """
+        if not content.startswith(self._textified_source):
+            # The content changed (not just grew), so start over
+            self._textified_source = ""
+            self._textified = ""
+            self._inside_code_block = False
+
+        # Textify (and remember) the lines that have been completed since last time
+        start = len(self._textified_source)
+        last_newline = content.rfind("\n", start)
+        if last_newline != -1:
+            textified, self._inside_code_block = _textify_code_fences(
+                content[start : last_newline + 1], self._inside_code_block
+            )
+            self._textified += textified
+            self._textified_source = content[: last_newline + 1]
+
+        # The last line may still change, so it's done again every time
+        last_line, _ = _textify_code_fences(
+            content[len(self._textified_source) :], self._inside_code_block
+        )
+        return self._textified + last_line
+
+
+class HeadlessMessageBlock(MessageBlock):
+    """
+    A MessageBlock that keeps track of the message, but never displays it.
+
+    Used when the Interpreter is headless, so no time is spent rendering
+    Markdown that nobody is watching.
+    """
+
+    def __init__(self):
+        """
+        Initialize a new HeadlessMessageBlock instance (without a Live display).
+        """
+        self.content = ""
+        self.output = ""
+        self._last_refresh = 0.0
+
+    def end(self):
+        pass
+
+    def refresh(self, cursor=True):
+        pass
+
 
 def textify_markdown_code_blocks(text):
     """
@@ -124,17 +208,44 @@ def textify_markdown_code_blocks(text):
         str: The modified text with Markdown code blocks replaced by text code blocks.
 
     """
-    replacement = "```text"
-    lines = text.split("\n")
-    inside_code_block = False
+    text, _ = _textify_code_fences(text, False)
+    return text
+
 
-    for i, line in enumerate(lines):
-        # If the line matches ``` followed by optional language specifier
-        if re.match(r"^```(\w*)$", line.strip()):
-            inside_code_block = not inside_code_block
+def _textify_code_fences(text, inside_code_block):
+    """
+    Turns the markdown code blocks that start in `text` into text code blocks.
 
-            # If we just entered a code block, replace the marker
-            if inside_code_block:
-                lines[i] = replacement
+    The regex finds the fences in one pass over the whole text, and the result
+    is stitched together from slices, rather than by splitting the text into
+    lines and matching them one at a time.
 
-    return "\n".join(lines)
+    Args:
+        text (str): Lines of text.
+        inside_code_block (bool): Whether the first line is inside a code block.
+
+    Returns:
+        tuple: The new text, and whether the text after it is inside a code block.
+    """
+    # Most messages have no code blocks, so there's nothing to replace
+    if "```" not in text:
+        return text, inside_code_block
+
+    parts = []
+    last = 0  # Where the part of text we haven't copied yet starts
+    for match in _FENCE_PATTERN.finditer(text):
+        start = match.start()
+        line_start = text.rfind("\n", 0, start) + 1
+        if line_start < start and not text[line_start:start].isspace():
+            continue
+
+        inside_code_block = not inside_code_block
+
+        # If we just entered a code block, replace the marker (the whole line)
+        if inside_code_block:
+            parts.append(text[last:line_start])
+            parts.append("```text")
+            last = match.end()
+
+    parts.append(text[last:])
+    return "".join(parts), inside_code_block
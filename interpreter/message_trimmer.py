@@ -0,0 +1,206 @@
+"""
+This module trims the message history so it fits in the model's context window.
+
+tokentrim.trim re-tokenizes every message on every call, which gets slower as
+the conversation grows. MessageTrimmer counts each message's tokens once and
+remembers the count.
+
+It also drops old messages in big chunks rather than one at a time. Trimming
+a message or two off the front every turn would change the start of every
+request, so providers could never reuse their cache of the prompt prefix.
+Dropping more than we need to means the next several turns need no trimming
+and start exactly the same way.
+
+Key Components:
+- MessageTrimmer: Keeps per-message token counts and trims messages to a budget.
+"""
+
+
+def _num_tokens(message, model):
+    """
+    Counts the tokens of a single message, the same way tokentrim does.
+    """
+    from tokentrim.tokentrim import num_tokens_from_messages
+
+    # num_tokens_from_messages adds the 3 priming tokens once per list, not per message
+    return num_tokens_from_messages([message], model) - 3
+
+
+class MessageTrimmer:
+    """
+    Trims messages to a token budget, counting the tokens of each message only once.
+    """
+
+    # Fraction of the model's context window we fill, like tokentrim's trim_ratio
+    trim_ratio = 0.75
+
+    # When we have to trim, trim down to this fraction of the budget
+    prune_ratio = 0.75
+
+    def __init__(self):
+        # The model the counts below are for
+        self._model = None
+        # id(message) -> (message, content length, token count)
+        self._counts = {}
+        # (system message, token count)
+        self._system_message_count = None
+        # The first message we kept last time, and its index
+        self._first = None
+        self._start = 0
+
+    def count(self, message, model=None):
+        """
+        Returns the number of tokens a message uses, from the cache when possible.
+
+        Args:
+            message (dict): The message to count.
+            model (str): The model, or None for local models.
+
+        Returns:
+            int: The number of tokens.
+        """
+        self._use_model(model)
+
+        content_length = len(message.get("content") or "")
+        cached = self._counts.get(id(message))
+        # Keep the message itself, so a new dict that reuses the id isn't mistaken for it
+        if cached is not None and cached[0] is message and cached[1] == content_length:
+            return cached[2]
+
+        tokens = _num_tokens(message, model)
+        self._counts[id(message)] = (message, content_length, tokens)
+        return tokens
+
+    def _use_model(self, model):
+        """
+        Forgets the cached counts when the model changes, since models count tokens differently.
+        """
+        if model != self._model:
+            self._model = model
+            self._counts = {}
+            self._system_message_count = None
+            # The new model may fit messages we dropped for the old one
+            self._start = 0
+            self._first = None
+
+    def budget(self, model):
+        """
+        Returns the number of tokens we may send to a model, or None if we don't know it.
+        """
+        from tokentrim.model_map import MODEL_MAX_TOKENS
+
+        if model not in MODEL_MAX_TOKENS:
+            return None
+        return int(MODEL_MAX_TOKENS[model] * self.trim_ratio)
+
+    def trim(self, messages, system_message, model=None, max_tokens=None):
+        """
+        Returns the system message followed by the most recent messages that fit.
+
+        Args:
+            messages (list): The message history.
+            system_message (str): The system message to put first.
+            model (str): The model, or None for local models.
+            max_tokens (int): The token budget. Defaults to the model's budget.
+
+        Returns:
+            list: The messages to send, or None if they can't be trimmed
+            by dropping whole messages (the model is unknown, or even the
+            last message is too long). Callers should fall back to tokentrim,
+            which can shorten messages.
+        """
+        if max_tokens is None:
+            max_tokens = self.budget(model)
+            if max_tokens is None:
+                return None
+
+        self._use_model(model)
+
+        system_message_event = {"role": "system", "content": system_message}
+        cached = self._system_message_count
+        if cached is None or cached[0] != system_message:
+            cached = (system_message, _num_tokens(system_message_event, model))
+            self._system_message_count = cached
+        # Every request also spends 3 tokens priming the reply. Like tokentrim,
+        # leave room for the system message twice: the slack is our margin for
+        # the counts being off (tiktoken only approximates, e.g., Llama's tokenizer).
+        remaining = max_tokens - 2 * cached[1] - 3
+
+        # Keep starting where we started last time, as long as that message is still there
+        start = self._start
+        if start >= len(messages) or messages[start] is not self._first:
+            start = 0
+
+        counts = [self.count(message, model) for message in messages[start:]]
+        total = sum(counts)
+
+        if total > remaining:
+            # Drop old messages until we're well under the budget...
+            dropped = 0
+            while dropped < len(counts) and total >= remaining * self.prune_ratio:
+                total -= counts[dropped]
+                dropped += 1
+
+            # ...then on to the next user message, so we never keep
+            # a function result without the call that produced it
+            aligned = dropped
+            while aligned < len(counts) and messages[start + aligned].get("role") != "user":
+                aligned += 1
+            if aligned < len(counts):
+                dropped = aligned
+            else:
+                # There's no later user message, so at least
+                # don't start with the results of a dropped call
+                while (
+                    dropped < len(counts)
+                    and messages[start + dropped].get("role") == "function"
+                ):
+                    dropped += 1
+
+            if dropped == len(counts):
+                # Nothing's left (e.g. the last message alone is too big
+                # to prune down to the target)
+                return self._trim_from_end(messages, system_message_event, remaining)
+            start += dropped
+
+        self._start = start
+        self._first = messages[start] if start < len(messages) else None
+
+        self._forget_removed(messages)
+
+        return [system_message_event] + messages[start:]
+
+    def _trim_from_end(self, messages, system_message_event, remaining):
+        """
+        Returns the system message followed by the most recent messages that fit,
+        or None if none do (not counting function results without their call).
+        """
+        model = self._model
+        start = len(messages)
+        while start > 0:
+            tokens = self.count(messages[start - 1], model)
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            start -= 1
+
+        # Don't start with the results of a call we didn't keep
+        while start < len(messages) and messages[start].get("role") == "function":
+            start += 1
+
+        if start == len(messages):
+            return None
+
+        self._forget_removed(messages)
+
+        return [system_message_event] + messages[start:]
+
+    def _forget_removed(self, messages):
+        """
+        Forgets the counts of messages that are gone (e.g. after %undo).
+        """
+        if len(self._counts) > len(messages):
+            kept = {id(message) for message in messages}
+            self._counts = {
+                key: value for key, value in self._counts.items() if key in kept
+            }
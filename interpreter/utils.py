@@ -3,12 +3,77 @@ This module provides utility functions for working with
 JSON data and merging JSON deltas.
 
 Key Functions:
+- dumps_json(obj, indent, sort_keys): Serializes an object to JSON bytes
+(with orjson when it's installed).
+- loads_json(data): Parses JSON from bytes or a string
+(with orjson when it's installed).
 - merge_deltas(original, delta): Merges a JSON delta
 into an original JSON object.
+- coalesce_chunks(chunks, max_interval, max_batch): Batches
+streaming chunks so each one isn't processed on its own.
 - parse_partial_json(s): Attempts to parse a partial
 JSON string and corrects some common issues.
+- PartialJSONParser: parse_partial_json for a JSON document
+that streams in, scanning each character only once.
+- StringObjectParser: Incrementally parses a streamed JSON object
+whose values are all strings (like run_code's arguments).
+- CodeFenceParser: Tracks the code block that's open in a streamed
+Markdown message (which is how Code-Llama writes code).
 """
 import json
+import re
+import time
+
+try:
+    # orjson is much faster, especially for long message histories,
+    # but it's optional: we fall back to the standard library without it
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_json(obj, indent=False, sort_keys=False):
+    """
+    Serialize an object to UTF-8 encoded JSON.
+
+    Args:
+        obj: The object to serialize.
+        indent (bool): Whether to indent the output by 2 spaces.
+        sort_keys (bool): Whether to sort the keys of dictionaries.
+
+    Returns:
+        bytes: The JSON document.
+    """
+    if orjson is not None:
+        option = 0
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+
+    return json.dumps(
+        obj, indent=2 if indent else None, sort_keys=sort_keys, ensure_ascii=False
+    ).encode("utf8")
+
+
+def loads_json(data):
+    """
+    Parse a JSON document.
+
+    Args:
+        data (bytes or str): The JSON document.
+
+    Returns:
+        The parsed object.
+
+    Raises:
+        json.JSONDecodeError: If the document isn't valid JSON
+        (orjson's error is a subclass of it).
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
 
 def merge_deltas(original, delta):
@@ -29,19 +94,152 @@ def merge_deltas(original, delta):
         dict: The original JSON object with the delta applied.
     """
     for key, value in delta.items():
-        if isinstance(value, dict):
-            if key not in original:
-                original[key] = value
-            else:
-                merge_deltas(original[key], value)
+        if value is None:
+            # Nothing to merge (e.g. the "content": null of a function call)
+            continue
+        # One lookup per key, rather than checking `key in original` first
+        existing = original.get(key)
+        if existing is None:
+            original[key] = value
+        elif isinstance(value, dict):
+            merge_deltas(existing, value)
         else:
-            if key in original:
-                original[key] += value
-            else:
-                original[key] = value
+            original[key] = existing + value
     return original
 
 
+def _merge_chunk_deltas(deltas):
+    """
+    Merge several streaming deltas into one, skipping empty (None) values.
+    """
+    merged = {}
+    for delta in deltas:
+        for key, value in delta.items():
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                merged[key] = _merge_chunk_deltas([merged.get(key) or {}, value])
+            elif key in merged:
+                merged[key] += value
+            else:
+                merged[key] = value
+    return merged
+
+
+def _merge_chunks(chunks):
+    """
+    Merge buffered streaming chunks into a single chunk.
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+
+    choices = [chunk["choices"][0] for chunk in chunks]
+    merged = {"finish_reason": choices[-1].get("finish_reason")}
+    if "text" in choices[0]:
+        # Completion (Code-Llama) chunks
+        merged["text"] = "".join([choice["text"] for choice in choices])
+    else:
+        # Chat completion chunks
+        merged["delta"] = _merge_chunk_deltas([choice["delta"] for choice in choices])
+    return {"choices": [merged]}
+
+
+def coalesce_chunks(chunks, max_interval=0.04, max_batch=16):
+    """
+    Batch streaming chunks, so the code consuming them runs less often.
+
+    Every chunk we yield gets merged into the message, parsed and rendered,
+    which costs far more than the chunk itself at 50+ tokens per second.
+    The first chunk is yielded on its own (so output starts right away),
+    then batches grow 3x at a time up to `max_batch` chunks, and a batch is
+    yielded once it's been filling for `max_interval` seconds. That's checked
+    when a chunk arrives (there's no timer), so on a slow stream a buffered
+    chunk can wait for the gap to the next one.
+
+    Chunks with a finish_reason end the batch they're in, and so do chunks
+    that end a line (of text, or of the code in a function call), so whole
+    lines are shown as soon as they're complete. Chunks containing backticks
+    are yielded on their own, because that's where code blocks start and end
+    in Code-Llama's output.
+
+    Args:
+        chunks (iterable): OpenAI-style streaming chunks, with a "delta"
+        (chat completions) or "text" (completions) under choices[0].
+        max_interval (float): How long a batch may fill before the next chunk that
+        arrives yields it, in seconds.
+        max_batch (int): The most chunks merged into one.
+
+    Yields:
+        dict: Chunks, each possibly merged from several.
+    """
+    buffer = []
+    batch_size = 1
+    started = 0
+
+    for chunk in chunks:
+        choices = chunk.get("choices")
+        if not choices:
+            # Azure OpenAI Service may return empty chunks
+            continue
+        choice = choices[0]
+
+        if "text" in choice:
+            text = choice["text"]
+            ends_line = "\n" in text
+        else:
+            delta = choice["delta"]
+            text = delta.get("content") or ""
+            # Newlines in function call arguments are escaped, since they're JSON
+            arguments = (delta.get("function_call") or {}).get("arguments") or ""
+            ends_line = "\n" in text or "\\n" in arguments
+        if "`" in text:
+            if buffer:
+                yield _merge_chunks(buffer)
+                buffer = []
+            yield chunk
+            continue
+
+        if not buffer:
+            started = time.monotonic()
+        buffer.append(chunk)
+
+        if (
+            choice.get("finish_reason")
+            or ends_line
+            or len(buffer) >= batch_size
+            or time.monotonic() - started >= max_interval
+        ):
+            yield _merge_chunks(buffer)
+            buffer = []
+            batch_size = min(batch_size * 3, max_batch)
+
+    if buffer:
+        yield _merge_chunks(buffer)
+
+
+def _close_by_counting(partial_json):
+    """
+    Guess the closing quote and brackets a partial JSON document needs
+    with str.count, rather than scanning it.
+
+    Quotes and brackets inside strings throw the counts off, but then
+    the guess doesn't parse, and parse_partial_json scans instead.
+    (Only the right closing characters can complete a document,
+    so a guess that parses is the same as what the scan would find.)
+
+    Returns:
+        str or None: The closed document, or None if we can't guess.
+    """
+    braces = partial_json.count("{") - partial_json.count("}")
+    brackets = partial_json.count("[") - partial_json.count("]")
+    if braces < 0 or brackets < 0 or (braces and brackets):
+        # Brackets inside strings, or we can't tell which order to close them in
+        return None
+
+    quotes = partial_json.count('"') - partial_json.count('\\"')
+    return partial_json + '"' * (quotes % 2) + "}" * braces + "]" * brackets
+
+
 def parse_partial_json(partial_json):
     """
     Attempt to parse a partial JSON string and correct common issues.
@@ -59,56 +257,405 @@ def parse_partial_json(partial_json):
     """
     # Attempt to parse the string as-is.
     try:
-        return json.loads(partial_json)
+        return loads_json(partial_json)
     except json.JSONDecodeError:
         pass
 
-    # Initialize variables.
-    new_s = ""
-    stack = []
-    is_inside_string = False
-    escaped = False
-
-    # Process each character in the string one at a time.
-    for char in partial_json:
-        if is_inside_string:
-            if char == '"' and not escaped:
-                is_inside_string = False
-            elif char == "\n" and not escaped:
-                char = "\\n"  # Replace the newline character with the escape sequence.
-            elif char == "\\":
-                escaped = not escaped
+    # While streaming, usually all that's missing is a closing quote and brackets.
+    # Try guessing them by counting, before scanning every character.
+    closed_json = _close_by_counting(partial_json)
+    if closed_json is not None:
+        try:
+            return loads_json(closed_json)
+        except json.JSONDecodeError:
+            pass
+
+    # Scan it, fixing what we find
+    return PartialJSONParser().parse(partial_json)
+
+
+# Runs of characters that PartialJSONParser passes over, inside and outside strings
+_PLAIN_STRING_CHARS = re.compile(r'[^"\\\n]*')
+_PLAIN_CHARS = re.compile(r'[^"{}\[\]]*')
+
+
+class PartialJSONParser:
+    """
+    parse_partial_json for a JSON document that streams in.
+
+    The scan for unclosed strings and brackets picks up where the last call
+    left off, so each character is only scanned once, however many times
+    the growing document is parsed.
+
+    Usage:
+        parser = PartialJSONParser()
+        parser.parse('{"a": [1, 2')  # {"a": [1, 2]}
+        parser.parse('{"a": [1, 2, 3], "b": "x')  # {"a": [1, 2, 3], "b": "x"}
+    """
+
+    def __init__(self):
+        # The document scanned so far, with newlines in strings escaped
+        self._fixed = ""
+        self._scanned = 0
+        self._stack = []
+        self._inside_string = False
+        self._escaped = False
+        self._malformed = False
+
+    def parse(self, partial_json):
+        """
+        Parses the document so far, closing any open string and brackets.
+
+        Args:
+            partial_json (str): The document so far (the last call's, plus more).
+
+        Returns:
+            The parsed JSON, or None if it can't be parsed.
+        """
+        if not self._malformed:
+            self._scan(partial_json)
+        if self._malformed:
+            # A mismatched closing bracket; no amount of closing fixes that
+            return None
+
+        # Close the string we're in, and any open structures
+        # in the reverse order that they were opened.
+        closed_json = self._fixed
+        if self._inside_string:
+            closed_json += '"'
+        closed_json += "".join(reversed(self._stack))
+
+        # Attempt to parse the modified string as JSON.
+        try:
+            return loads_json(closed_json)
+        except json.JSONDecodeError:
+            # If we still can't parse the string as JSON, return None to indicate failure.
+            return None
+
+    def _scan(self, partial_json):
+        """
+        Scans what's new since the last call.
+        """
+        # The fixed string is built from slices of partial_json (rather than
+        # one character at a time), so only the changes need copying one by one.
+        parts = [self._fixed]
+        last = self._scanned  # Where the part of partial_json we haven't copied yet starts
+        stack = self._stack
+        is_inside_string = self._inside_string
+        escaped = self._escaped
+
+        # Skip over runs of characters that need no handling with a regex
+        # (a scan in C), and only look at the others one at a time.
+        i = self._scanned
+        end = len(partial_json)
+        while i < end:
+            if is_inside_string:
+                if escaped:
+                    # Whatever follows a backslash is taken as it is
+                    escaped = False
+                    i += 1
+                    continue
+                i = _PLAIN_STRING_CHARS.match(partial_json, i).end()
+                if i == end:
+                    break
+                char = partial_json[i]
+                if char == '"':
+                    is_inside_string = False
+                elif char == "\n":
+                    # Replace the newline character with the escape sequence.
+                    parts.append(partial_json[last:i])
+                    parts.append("\\n")
+                    last = i + 1
+                else:  # A backslash
+                    escaped = True
             else:
-                escaped = False
-        else:
-            if char == '"':
-                is_inside_string = True
-                escaped = False
-            elif char == "{":
-                stack.append("}")
-            elif char == "[":
-                stack.append("]")
-            elif char == "}" or char == "]":
-                if stack and stack[-1] == char:
+                i = _PLAIN_CHARS.match(partial_json, i).end()
+                if i == end:
+                    break
+                char = partial_json[i]
+                if char == '"':
+                    is_inside_string = True
+                elif char == "{":
+                    stack.append("}")
+                elif char == "[":
+                    stack.append("]")
+                elif stack and stack[-1] == char:
                     stack.pop()
                 else:
                     # Mismatched closing character; the input is malformed.
-                    return None
+                    self._malformed = True
+                    return
+            i += 1
 
-        # Append the processed character to the new string.
-        new_s += char
+        parts.append(partial_json[last:])
+        self._fixed = "".join(parts)
+        self._scanned = len(partial_json)
+        self._inside_string = is_inside_string
+        self._escaped = escaped
 
-    # If we're still inside a string at the end of processing, we need to close the string.
-    if is_inside_string:
-        new_s += '"'
 
-    # Close any remaining open structures in the reverse order that they were opened.
-    for closing_char in reversed(stack):
-        new_s += closing_char
+# A run of characters inside a JSON string that need no special handling
+_STRING_CHARS = re.compile(r'[^"\\]*')
 
-    # Attempt to parse the modified string as JSON.
-    try:
-        return json.loads(new_s)
-    except json.JSONDecodeError:
-        # If we still can't parse the string as JSON, return None to indicate failure.
-        return None
+# What each JSON escape sequence (after the backslash) stands for
+_JSON_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class StringObjectParser:
+    """
+    Incrementally parses a streamed JSON object whose values are all strings.
+
+    parse_partial_json() re-parses the whole string every time a bit more of
+    it arrives, which is quadratic in its length. Function call arguments like
+    `{"language": "python", "code": "..."}` can be fed to this parser a piece
+    at a time instead, and each piece is only looked at once.
+
+    If the JSON turns out to be something else (say, a value that isn't a
+    string), feed() returns None from then on, and callers should fall back
+    to parse_partial_json().
+
+    Usage:
+        parser = StringObjectParser()
+        parser.feed('{"language": "pyt')  # {"language": "pyt"}
+        parser.feed('hon", "code": "1')  # {"language": "python", "code": "1"}
+    """
+
+    def __init__(self):
+        self.failed = False
+        # Where we are: before the "{", in a "key", before a "colon" or a "value",
+        # in a "string", at the "end" of a value (or the "{"), or "done"
+        self._state = "{"
+        self._key = []
+        self._escape = ""  # An escape sequence split across pieces
+        self._values = {}  # Key -> list of string parts
+        self._current = None  # The parts of the string being read
+        self._high_surrogate = None  # Half of a \uXXXX\uXXXX pair
+
+    def feed(self, text):
+        """
+        Parses the next piece of the JSON.
+
+        Args:
+            text (str): The text that arrived since the last call.
+
+        Returns:
+            dict or None: The object so far (the last string may be incomplete),
+            or None if the JSON isn't an object of strings.
+        """
+        if not self.failed:
+            try:
+                self._parse(text)
+            except ValueError:
+                self.failed = True
+        if self.failed:
+            return None
+        return {key: "".join(parts) for key, parts in self._values.items()}
+
+    def _parse(self, text):
+        index = 0
+        length = len(text)
+        while index < length:
+            state = self._state
+
+            if state == "string":
+                if self._escape:
+                    index = self._read_escape(text, index)
+                    continue
+                # Copy everything up to the next quote or backslash in one go
+                end = _STRING_CHARS.match(text, index).end()
+                if end > index:
+                    self._current.append(text[index:end])
+                if end == length:
+                    return
+                if text[end] == '"':
+                    self._state = "end"
+                    index = end + 1
+                else:
+                    self._escape = "\\"
+                    index = end + 1
+                continue
+
+            if state == "key":
+                end = text.find('"', index)
+                if end == -1:
+                    self._key.append(text[index:])
+                    return
+                self._key.append(text[index:end])
+                self._state = "colon"
+                index = end + 1
+                continue
+
+            char = text[index]
+            index += 1
+            if char.isspace():
+                continue
+
+            if state == "{":
+                if char != "{":
+                    raise ValueError("Expected an object")
+                self._state = "end"
+            elif state == "end":
+                # After "{" or a value: another key, or the end of the object
+                if char == '"':
+                    self._key = []
+                    self._state = "key"
+                elif char == "}":
+                    self._state = "done"
+                elif char != ",":
+                    raise ValueError(f"Unexpected {char!r}")
+            elif state == "colon":
+                if char != ":":
+                    raise ValueError("Expected ':'")
+                self._state = "value"
+            elif state == "value":
+                if char != '"':
+                    raise ValueError("Expected a string")
+                self._current = self._values["".join(self._key)] = []
+                self._state = "string"
+            else:
+                raise ValueError("Unexpected text after the object")
+
+    def _read_escape(self, text, index):
+        """
+        Reads (more of) an escape sequence inside a string.
+
+        Returns:
+            int: The index after what was read.
+        """
+        escape = self._escape
+        if escape == "\\":
+            escape += text[index]
+            index += 1
+        if escape[1] == "u":
+            # \uXXXX
+            missing = 6 - len(escape)
+            escape += text[index : index + missing]
+            index += min(missing, len(text) - index)
+            if len(escape) < 6:
+                self._escape = escape
+                return index
+            code_point = int(escape[2:], 16)
+            high, self._high_surrogate = self._high_surrogate, None
+            if 0xD800 <= code_point <= 0xDBFF:
+                # The first half of a surrogate pair (like an emoji).
+                # Wait for the second half rather than show half a character.
+                self._high_surrogate = code_point
+                self._escape = ""
+                return index
+            if high is not None and 0xDC00 <= code_point <= 0xDFFF:
+                code_point = 0x10000 + ((high - 0xD800) << 10) + (code_point - 0xDC00)
+            self._current.append(chr(code_point))
+        elif escape[1] in _JSON_ESCAPES:
+            self._current.append(_JSON_ESCAPES[escape[1]])
+        else:
+            raise ValueError(f"Invalid escape {escape!r}")
+        self._escape = ""
+        return index
+
+
+class CodeFenceParser:
+    """
+    Tracks the code block that's open in a streamed Markdown message.
+
+    Code-Llama can't call functions, so it writes code in "```" fenced
+    blocks instead. Call update() with the message each time it grows.
+    It only looks at the new text (and the 2 characters before it, for
+    fences split across chunks), so a whole message is scanned once.
+
+    Usage:
+        parser = CodeFenceParser()
+        message = "Here:\n```python\npri"
+        parser.update(message)  # True (a block is open)
+        parser.arguments(message)  # {"code": "pri", "language": "python"}
+    """
+
+    def __init__(self):
+        self.fence_count = 0
+        self._scan_start = 0
+        # Where the last fence starts, and where the code after it starts
+        # (once its language line is finished)
+        self._last_fence = -1
+        self._code_start = None
+        self._first_line = ""
+
+    def update(self, content):
+        """
+        Finds any new fences in the message.
+
+        Args:
+            content (str): The message so far.
+
+        Returns:
+            bool: Whether a code block is open (the number of fences is odd).
+        """
+        fence = content.find("```", self._scan_start)
+        while fence != -1:
+            self.fence_count += 1
+            self._last_fence = fence
+            self._code_start = None
+            self._scan_start = fence + 3
+            fence = content.find("```", self._scan_start)
+        self._scan_start = max(self._scan_start, len(content) - 2)
+        return self.fence_count % 2 == 1
+
+    def arguments(self, content):
+        """
+        Parses the open code block into run_code's arguments.
+
+        Args:
+            content (str): The message so far (as last passed to update()).
+
+        Returns:
+            dict: The "code", and the "language" once we know it.
+            Empty if no block has been opened.
+        """
+        if self._last_fence == -1:
+            return {}
+
+        # The code block starts after the last "```",
+        # with the language on its first line
+        if self._code_start is None:
+            newline = content.find("\n", self._last_fence + 3)
+            if newline != -1:
+                self._code_start = newline + 1
+                self._first_line = content[self._last_fence + 3 : newline]
+            else:
+                self._first_line = content[self._last_fence + 3 :]
+
+        # Everything except for the language line
+        if self._code_start is None:
+            code = ""
+        else:
+            code = content[self._code_start :].strip("` \n")
+
+        if (
+            not code and not self._first_line.strip() and content.strip() == "```"
+        ):  # Hasn't outputted a language yet
+            language = None
+        elif self._first_line != "":
+            language = self._first_line.strip()
+        else:
+            language = "python"
+            # In anticipation of its dumbassery let's check if "pip" is in there
+            if self._code_start is not None and content.startswith(
+                "pip", self._code_start
+            ):
+                language = "shell"
+
+        arguments = {"code": code}
+        if language:
+            # We only add this if we have it-- the second we have it,
+            # an interpreter gets fired up
+            if language == "bash":
+                language = "shell"
+            arguments["language"] = language
+        return arguments
@@ -0,0 +1,130 @@
+"""
+check_import_time.py - Guard the startup time of the `interpreter` command.
+
+Runs `python -X importtime -c "import interpreter.cli"` in a fresh process,
+parses the import tree it prints, and fails if:
+
+- importing `interpreter.cli` takes longer than the total budget,
+- any single module takes longer than the per-module budget, or
+- one of the heavy dependencies that should only be imported lazily
+  (rich, litellm, requests, ...) shows up at all.
+
+Usage:
+    python scripts/check_import_time.py [--budget-ms 100] [--module-budget-ms 50]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# The module whose import time we're guarding
+TARGET = "interpreter.cli"
+
+# These are only needed once we actually chat, so they must not be imported by TARGET
+LAZY_MODULES = [
+    "dotenv",
+    "inquirer",
+    "litellm",
+    "openai",
+    "pkg_resources",
+    "requests",
+    "rich",
+    "tiktoken",
+    "tokentrim",
+]
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_imports(target):
+    """
+    Import `target` in a fresh interpreter with `-X importtime`.
+
+    Returns:
+        list: (module, self_us, cumulative_us, depth) for every module imported,
+        in the order Python reports them (children before their parents).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing {target} failed:\n{result.stderr}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:       109 |       6169 |     fnmatch"
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The header row
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=100,
+        help=f"max cumulative time to import {TARGET}",
+    )
+    parser.add_argument(
+        "--module-budget-ms",
+        type=float,
+        default=50,
+        help="max time any single module may spend importing itself",
+    )
+    args = parser.parse_args()
+
+    imports = measure_imports(TARGET)
+    problems = []
+
+    # Only look at what TARGET pulls in, not at interpreter startup (site, encodings, ...)
+    target_index = next(
+        (i for i, (name, *_) in enumerate(imports) if name == TARGET), None
+    )
+    if target_index is None:
+        sys.exit(f"{TARGET} was not imported (was it already imported by site?)")
+    target_depth = imports[target_index][3]
+    start = target_index
+    while start > 0 and imports[start - 1][3] > target_depth:
+        start -= 1
+    target_imports = imports[start : target_index + 1]
+
+    total_ms = imports[target_index][2] / 1000
+    if total_ms > args.budget_ms:
+        problems.append(
+            f"importing {TARGET} took {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)"
+        )
+
+    for name, self_us, _, _ in target_imports:
+        if self_us / 1000 > args.module_budget_ms:
+            problems.append(
+                f"{name} took {self_us / 1000:.1f} ms to import "
+                f"(budget {args.module_budget_ms:.0f} ms)"
+            )
+        if name.split(".")[0] in LAZY_MODULES:
+            problems.append(f"{name} is imported eagerly, it should be imported lazily")
+
+    # Slowest imports first, to show where the time goes
+    slowest = sorted(target_imports, key=lambda entry: entry[1], reverse=True)[:10]
+    print(f"{TARGET}: {total_ms:.1f} ms")
+    for name, self_us, cumulative_us, _ in slowest:
+        print(f"  {self_us / 1000:8.1f} ms self {cumulative_us / 1000:8.1f} ms total  {name}")
+
+    if problems:
+        print("\nImport time check failed:")
+        for problem in dict.fromkeys(problems):
+            print(f"- {problem}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
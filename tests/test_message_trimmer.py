@@ -0,0 +1,137 @@
+import pytest
+
+from interpreter import message_trimmer
+from interpreter.message_trimmer import MessageTrimmer
+
+SYSTEM_MESSAGE = "sys"  # 3 "tokens"
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    """
+    Counts one token per character of content (tiktoken needs a download),
+    and records every message that gets counted.
+    """
+    counted = []
+
+    def num_tokens(message, model):
+        counted.append(message)
+        return len(message.get("content") or "")
+
+    monkeypatch.setattr(message_trimmer, "_num_tokens", num_tokens)
+    return counted
+
+
+def user(content):
+    return {"role": "user", "content": content}
+
+
+def assistant(content):
+    return {"role": "assistant", "content": content}
+
+
+def function(content):
+    return {"role": "function", "name": "run_code", "content": content}
+
+
+def conversation(turns, length=10):
+    messages = []
+    for i in range(turns):
+        messages.append(user(str(i) * length))
+        messages.append(assistant(str(i) * length))
+    return messages
+
+
+def test_count_is_cached_until_the_content_changes(counted):
+    trimmer = MessageTrimmer()
+    message = assistant("hello")
+
+    assert trimmer.count(message) == 5
+    assert trimmer.count(message) == 5
+    assert counted == [message]
+
+    # Streaming grows the message in place
+    message["content"] += " world"
+    assert trimmer.count(message) == 11
+    assert len(counted) == 2
+
+    # An equal, but different, message is counted on its own
+    assert trimmer.count(assistant("hello world")) == 11
+    assert len(counted) == 3
+
+def test_trim_keeps_everything_that_fits(counted):
+    messages = conversation(3)
+    trimmed = MessageTrimmer().trim(messages, SYSTEM_MESSAGE, max_tokens=1000)
+    assert trimmed == [{"role": "system", "content": SYSTEM_MESSAGE}] + messages
+
+def test_trim_with_max_tokens_drops_whole_turns(counted):
+    messages = conversation(10)  # 200 tokens
+    trimmed = MessageTrimmer().trim(messages, SYSTEM_MESSAGE, max_tokens=150)
+
+    assert trimmed[0] == {"role": "system", "content": SYSTEM_MESSAGE}
+    assert trimmed[1]["role"] == "user"
+    assert trimmed[-1] is messages[-1]
+    # Trimmed well under the budget (leaving room for the system message twice)
+    assert sum(len(m["content"]) for m in trimmed[1:]) <= (150 - 9) * 0.75
+
+def test_trim_keeps_starting_at_the_same_message(counted):
+    trimmer = MessageTrimmer()
+    messages = conversation(10)
+    first = trimmer.trim(messages, SYSTEM_MESSAGE, max_tokens=150)
+
+    messages.append(user("x"))
+    second = trimmer.trim(messages, SYSTEM_MESSAGE, max_tokens=150)
+    assert second[1] is first[1]
+    assert second[-1] is messages[-1]
+
+def test_trim_starts_over_after_undo(counted):
+    trimmer = MessageTrimmer()
+    messages = conversation(10)
+    first = trimmer.trim(messages, SYSTEM_MESSAGE, max_tokens=150)
+
+    # %undo removes the message we started at (and everything after it)
+    del messages[messages.index(first[1]) :]
+    trimmed = trimmer.trim(messages, SYSTEM_MESSAGE, max_tokens=150)
+    assert trimmed[1:] == messages
+    assert trimmed[1] is messages[0]
+
+def test_trim_starts_over_after_load(counted):
+    trimmer = MessageTrimmer()
+    trimmed = trimmer.trim(conversation(10), SYSTEM_MESSAGE, max_tokens=150)
+    assert trimmed[1]["content"] == "5" * 10
+
+    # load() brings in new messages, which are pruned from the start again
+    loaded = conversation(8)
+    trimmed = trimmer.trim(loaded, SYSTEM_MESSAGE, max_tokens=150)
+    assert trimmed[1] is loaded[6]
+    assert trimmed[-1] is loaded[-1]
+
+def test_trim_starts_over_when_the_model_changes(counted, monkeypatch):
+    monkeypatch.setattr(
+        "tokentrim.model_map.MODEL_MAX_TOKENS", {"small": 200, "big": 2000}
+    )
+    trimmer = MessageTrimmer()
+    messages = conversation(10)
+
+    assert trimmer.trim(messages, SYSTEM_MESSAGE, "small")[1] is not messages[0]
+    assert trimmer.trim(messages, SYSTEM_MESSAGE, "big")[1:] == messages
+
+def test_trim_never_starts_with_a_function_result(counted):
+    messages = [user("run it"), assistant("a" * 50), function("b" * 50)]
+    messages += [assistant("c" * 50), function("d" * 10), assistant("e" * 10)]
+
+    # Pruning stops at the function result, and there's no later user message
+    trimmed = MessageTrimmer().trim(messages, SYSTEM_MESSAGE, max_tokens=100)
+    assert trimmed[1:] == [messages[-1]]
+
+def test_trim_from_end_skips_function_results(counted):
+    messages = [user("hi"), assistant("x" * 500), function("y" * 10)]
+    assert MessageTrimmer().trim(messages, SYSTEM_MESSAGE, max_tokens=100) is None
+
+def test_trim_gives_up_when_the_last_message_is_too_big(counted):
+    messages = [user("hi"), assistant("x" * 500)]
+    assert MessageTrimmer().trim(messages, SYSTEM_MESSAGE, max_tokens=100) is None
+
+def test_trim_gives_up_on_unknown_models(counted):
+    trimmer = MessageTrimmer()
+    assert trimmer.trim(conversation(1), SYSTEM_MESSAGE, "no-such-model") is None
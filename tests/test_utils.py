@@ -0,0 +1,107 @@
+import json
+
+from interpreter.utils import (
+    CodeFenceParser,
+    PartialJSONParser,
+    StringObjectParser,
+    coalesce_chunks,
+    merge_deltas,
+    parse_partial_json,
+)
+
+
+def delta_chunk(delta, finish_reason=None):
+    return {"choices": [{"delta": delta, "finish_reason": finish_reason}]}
+
+
+def text_chunk(text, finish_reason=None):
+    return {"choices": [{"text": text, "finish_reason": finish_reason}]}
+
+
+def test_coalesce_chunks_keeps_the_message_intact():
+    chunks = [delta_chunk({"role": "assistant", "function_call": {"name": "run_code", "arguments": ""}})]
+    chunks += [delta_chunk({"function_call": {"arguments": str(i)}}) for i in range(40)]
+    chunks.append(delta_chunk({}, "function_call"))
+
+    coalesced = list(coalesce_chunks(chunks))
+    assert len(coalesced) < len(chunks)
+    assert coalesced[-1]["choices"][0]["finish_reason"] == "function_call"
+
+    message = {"content": ""}
+    for chunk in coalesced:
+        merge_deltas(message, chunk["choices"][0]["delta"])
+    assert message["function_call"]["arguments"] == "".join(str(i) for i in range(40))
+
+def test_coalesce_chunks_yields_backticks_on_their_own():
+    texts = ["Here", " it", " is:\n", "```", "python\n", "print", "(1)\n", "```", " done"]
+    chunks = [text_chunk(text) for text in texts] + [text_chunk("", "stop")]
+
+    coalesced = [chunk["choices"][0]["text"] for chunk in coalesce_chunks(chunks)]
+    assert "".join(coalesced) == "".join(texts)
+    assert coalesced.count("```") == 2
+
+def test_merge_deltas_skips_empty_values():
+    message = {"content": ""}
+    merge_deltas(message, {"role": "assistant", "content": None, "function_call": {"name": "run_code"}})
+    merge_deltas(message, {"content": None, "function_call": {"arguments": "{}"}})
+    assert message == {"role": "assistant", "content": "", "function_call": {"name": "run_code", "arguments": "{}"}}
+
+def test_string_object_parser_parses_pieces():
+    arguments = {"language": "python", "code": 'print("caf\u00e9 \U0001F600")\n\tx = "\\\\"'}
+    text = json.dumps(arguments)
+
+    parser = StringObjectParser()
+    for i in range(0, len(text), 3):
+        parsed = parser.feed(text[i : i + 3])
+        for key, value in parsed.items():
+            assert arguments[key].startswith(value)
+    assert parsed == arguments
+
+def test_string_object_parser_gives_up_on_other_json():
+    parser = StringObjectParser()
+    assert parser.feed('{"language": "python", "code": ') == {"language": "python"}
+    assert parser.feed("42}") is None
+
+def test_code_fence_parser_follows_the_open_block():
+    parser = CodeFenceParser()
+    message = ""
+    states = []
+    for piece in ["Sure:\n`", "``", "pyth", "on\nprint(", "1)\n`", "``", " Done."]:
+        message += piece
+        states.append((parser.update(message), parser.arguments(message)))
+
+    assert states[1] == (True, {"code": "", "language": "python"})
+    assert states[3] == (True, {"code": "print(", "language": "python"})
+    assert states[4] == (True, {"code": "print(1)", "language": "python"})
+    assert states[5][0] is False
+    assert parser.fence_count == 2
+
+def test_coalesce_chunks_ends_batches_at_new_lines():
+    pieces = ["import", " os", "\\n", "print", "(os", ".getcwd", "())", "\\n", "x"]
+    chunks = [delta_chunk({"function_call": {"arguments": piece}}) for piece in pieces]
+
+    coalesced = [
+        chunk["choices"][0]["delta"]["function_call"]["arguments"]
+        for chunk in coalesce_chunks(chunks, max_interval=60)
+    ]
+    # (The first chunk is always yielded on its own)
+    assert coalesced == ["import", " os\\n", "print(os.getcwd())\\n", "x"]
+
+def test_parse_partial_json_closes_what_is_open():
+    assert parse_partial_json('{"language": "python", "code": "print(') == {
+        "language": "python",
+        "code": "print(",
+    }
+    # Brackets inside strings, and raw newlines, need the full scan
+    assert parse_partial_json('[{"a": "}"') == [{"a": "}"}]
+    assert parse_partial_json('{"a": [1, {"b": "x\n') == {"a": [1, {"b": "x\n"}]}
+    assert parse_partial_json('{"a": 1]') is None
+
+def test_partial_json_parser_parses_pieces():
+    text = json.dumps({"timeout": 5, "code": "print([1])\nprint({})"})
+    text = text.replace("\\n", "\n")  # A raw newline, which the parser escapes
+
+    parser = PartialJSONParser()
+    for i in range(1, len(text) + 1):
+        assert parser.parse(text[:i]) == parse_partial_json(text[:i])
+    assert parser.parse(text) == {"timeout": 5, "code": "print([1])\nprint({})"}